@@ -0,0 +1,257 @@
+# This script measures speed of cutPrimers on synthetic amplicon reads
+# Reads are made from primers of the panel (fasta-files as for cutPrimers or synthetic panel of random primers)
+# Two benchmarks are done:
+#  trimPrimers - speed of trimming reads by function trimPrimers in one process
+#  cli - speed of the whole cutPrimers.py run for all combinations of parameters (-t, -err, -plb, panel, plain or gzipped files)
+# Results are written to JSON-file, so they can be compared between versions of cutPrimers
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from itertools import product,islice
+from Bio import SeqIO
+from Bio.Seq import Seq
+import cutPrimers
+
+def readPrimersSeqs(primersFile):
+    # This function reads fasta-file with primers and returns lists of their names and sequences
+    names=[]
+    seqs=[]
+    for r in SeqIO.parse(primersFile,'fasta'):
+        names.append(r.name)
+        seqs.append(str(r.seq).upper())
+    return(names,seqs)
+
+def revComplement(seq):
+    return(str(Seq(seq).reverse_complement()))
+
+def randomSeq(rand,length):
+    return(''.join(rand.choice('ACGT') for i in range(length)))
+
+def makePanel(rand,amplicons,outDir):
+    # This function makes panel of random primers for the number of amplicons
+    # and writes its primers to four fasta-files like example/primers_R1_5.fa, example/primers_R2_5.fa etc.
+    # It returns list of names of these files
+    forward=[randomSeq(rand,rand.randint(18,26)) for i in range(amplicons)]
+    reverse=[randomSeq(rand,rand.randint(18,26)) for i in range(amplicons)]
+    primersFiles=[]
+    for fileName,seqs,name,suffix in [('primers_R1_5.fa',reverse,'R',''),('primers_R2_5.fa',forward,'F',''),
+                                      ('primers_R1_3.fa',[revComplement(s) for s in forward],'F','_reversed'),
+                                      ('primers_R2_3.fa',[revComplement(s) for s in reverse],'R','_reversed')]:
+        primersFile=os.path.join(outDir,fileName)
+        file=open(primersFile,'w')
+        for i,seq in enumerate(seqs):
+            file.write('> '+name+str(i+1)+suffix+'\n'+seq+'\n')
+        file.close()
+        primersFiles.append(primersFile)
+    return(primersFiles)
+
+def addErrors(rand,seq,errorRate,indelFraction):
+    # This function adds substitutions, insertions and deletions to the sequence
+    # errorRate - probability of error for each nucleotide, indelFraction - part of errors that are insertions or deletions
+    newSeq=[]
+    for c in seq:
+        if rand.random()>=errorRate:
+            newSeq.append(c)
+        elif rand.random()>=indelFraction:
+            newSeq.append(rand.choice([n for n in 'ACGT' if n!=c]))
+        elif rand.random()<0.5:
+            newSeq.append(c+rand.choice('ACGT'))
+    return(''.join(newSeq))
+
+def generateReads(primersFiles,readsFileR1,readsFileR2,readsNum,readLen,errorRate,indelFraction,
+                  noPrimer3Fraction,dimerFraction,randomFraction,seed):
+    # This function writes synthetic paired-end reads of amplicons to two fastq-files (gzipped, if names end with .gz)
+    # Primers of amplicon i are the i-th primers of the four fasta-files. R1 read is
+    # primer R1 5' + insert + primer R1 3', and R2 read is its reverse complement
+    # noPrimer3Fraction - part of reads that end before the primer on the 3'-end
+    # dimerFraction - part of reads that are primer-dimers of random primers, randomFraction - part of reads without primers
+    # It returns numbers of reads of each type
+    rand=random.Random(seed)
+    primersR1_5=readPrimersSeqs(primersFiles[0])[1]
+    primersR2_5=readPrimersSeqs(primersFiles[1])[1]
+    primersR1_3=readPrimersSeqs(primersFiles[2])[1]
+    amplicons=len(primersR1_5)
+    inserts=[randomSeq(rand,rand.randint(max(readLen//3,20),max(readLen-60,40))) for i in range(amplicons)]
+    readsTypes={'amplicon':0,'no primer 3':0,'primer-dimer':0,'random':0}
+    if readsFileR1.endswith('.gz'):
+        fileR1=gzip.open(readsFileR1,'wt',compresslevel=1)
+        fileR2=gzip.open(readsFileR2,'wt',compresslevel=1)
+    else:
+        fileR1=open(readsFileR1,'w')
+        fileR2=open(readsFileR2,'w')
+    for i in range(readsNum):
+        ampliconNum=rand.randrange(amplicons)
+        x=rand.random()
+        if x<randomFraction:
+            readType='random'
+            seqR1=randomSeq(rand,readLen)
+            seqR2=randomSeq(rand,readLen)
+        elif x<randomFraction+dimerFraction:
+            readType='primer-dimer'
+            primerNum2=rand.randrange(amplicons)
+            seqR1=addErrors(rand,primersR1_5[ampliconNum],errorRate,indelFraction)+revComplement(primersR2_5[primerNum2])
+            seqR2=primersR2_5[primerNum2]+revComplement(primersR1_5[ampliconNum])
+        else:
+            amplicon=(addErrors(rand,primersR1_5[ampliconNum],errorRate,indelFraction)+inserts[ampliconNum]+
+                      addErrors(rand,primersR1_3[ampliconNum],errorRate,indelFraction))
+            seqR1=amplicon
+            seqR2=addErrors(rand,revComplement(amplicon),errorRate/2,indelFraction)
+            # Both reads end inside the insert
+            if x<randomFraction+dimerFraction+noPrimer3Fraction:
+                readType='no primer 3'
+                seqR1=seqR1[:len(primersR1_5[ampliconNum])+rand.randint(1,len(inserts[ampliconNum]))]
+                seqR2=seqR2[:len(primersR2_5[ampliconNum])+rand.randint(1,len(inserts[ampliconNum]))]
+            else:
+                readType='amplicon'
+            seqR1=seqR1[:readLen]
+            seqR2=seqR2[:readLen]
+        readsTypes[readType]+=1
+        header='@BENCH:1:FC:1:1:'+str(i)+':'+str(ampliconNum)+' '
+        for file,seq,readNum in [(fileR1,seqR1,'1'),(fileR2,seqR2,'2')]:
+            file.write(header+readNum+':N:0:'+readType.replace(' ','_')+'\n'+seq+'\n+\n'+'I'*len(seq)+'\n')
+    fileR1.close()
+    fileR2.close()
+    return(readsTypes)
+
+def countReads(readsFile):
+    if readsFile.endswith('.gz'):
+        file=gzip.open(readsFile,'rt')
+    else:
+        file=open(readsFile)
+    linesNum=sum(1 for string in file)
+    file.close()
+    return(linesNum//4)
+
+def benchmarkTrimPrimers(primersFiles,readsFileR1,readsFileR2,readsNum,errNumber,primerLocBuf,matcherType):
+    # This function measures speed of function trimPrimers in this process
+    # It returns time of trimming and number of trimmed reads
+    primerIndex=cutPrimers.readPrimers(primersFiles[0],primersFiles[1],primersFiles[2],primersFiles[3],str(errNumber))
+    cutPrimers.initializer(primerIndex,primerLocBuf,str(errNumber),primersFiles[2],primersFiles[1],primersFiles[3],
+                           readsFileR2,None,None,False,None,matcherType,(False,False))
+    handleR1=cutPrimers.openReadsFile(readsFileR1)[0]
+    handleR2=cutPrimers.openReadsFile(readsFileR2)[0]
+    reads=list(islice(zip(cutPrimers.parseFastq(cutPrimers.decodeReads(handleR1.read())),
+                            cutPrimers.parseFastq(cutPrimers.decodeReads(handleR2.read()))),readsNum))
+    handleR1.close()
+    handleR2.close()
+    trimmedNum=0
+    start=time.perf_counter()
+    for data in reads:
+        res=cutPrimers.trimPrimers(data)
+        if res[0][0][0] is not None:
+            trimmedNum+=1
+    return(time.perf_counter()-start,len(reads),trimmedNum)
+
+def benchmarkCli(primersFiles,readsFileR1,readsFileR2,outDir,threads,errNumber,primerLocBuf,matcherType,extraArgs):
+    # This function measures time of the whole run of cutPrimers.py
+    # It returns time of run and number of trimmed reads
+    ext='.fastq.gz' if readsFileR1.endswith('.gz') else '.fastq'
+    outputFiles=[os.path.join(outDir,name+ext) for name in ['trimmed_R1','trimmed_R2','untrimmed_R1','untrimmed_R2']]
+    command=[sys.executable,os.path.join(os.path.dirname(os.path.abspath(__file__)),'cutPrimers.py'),
+             '-r1',readsFileR1,'-r2',readsFileR2,
+             '-pr15',primersFiles[0],'-pr25',primersFiles[1],'-pr13',primersFiles[2],'-pr23',primersFiles[3],
+             '-tr1',outputFiles[0],'-tr2',outputFiles[1],'-utr1',outputFiles[2],'-utr2',outputFiles[3],
+             '-t',str(threads),'-err',str(errNumber),'-plb',str(primerLocBuf),'-matcher',matcherType]+extraArgs
+    start=time.perf_counter()
+    proc=subprocess.run(command,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE,universal_newlines=True)
+    seconds=time.perf_counter()-start
+    if proc.returncode!=0:
+        print('########')
+        print('ERROR! cutPrimers.py failed:',' '.join(command))
+        print(proc.stderr)
+        print('########')
+        exit(0)
+    return(seconds,countReads(outputFiles[0]))
+
+def parseList(value,valueType=str):
+    # This function converts comma-separated list from parameter to the list of values
+    return([valueType(v) for v in value.split(',') if v!=''])
+
+if __name__ == "__main__":
+    # Section of reading arguments
+    par=argparse.ArgumentParser(description='This script measures speed of cutPrimers on synthetic amplicon reads')
+    par.add_argument('--primersFileR1_5','-pr15',dest='primersFileR1_5',type=str,help='fasta-file with sequences of primers on the 5\'-end of R1 reads. Default: example/primers_R1_5.fa',default=os.path.join('example','primers_R1_5.fa'))
+    par.add_argument('--primersFileR2_5','-pr25',dest='primersFileR2_5',type=str,help='fasta-file with sequences of primers on the 5\'-end of R2 reads. Default: example/primers_R2_5.fa',default=os.path.join('example','primers_R2_5.fa'))
+    par.add_argument('--primersFileR1_3','-pr13',dest='primersFileR1_3',type=str,help='fasta-file with sequences of primers on the 3\'-end of R1 reads. Default: example/primers_R1_3.fa',default=os.path.join('example','primers_R1_3.fa'))
+    par.add_argument('--primersFileR2_3','-pr23',dest='primersFileR2_3',type=str,help='fasta-file with sequences of primers on the 3\'-end of R2 reads. Default: example/primers_R2_3.fa',default=os.path.join('example','primers_R2_3.fa'))
+    par.add_argument('--panels','-panels',dest='panels',type=str,help='comma-separated list of panels. "files" - panel from primers files (-pr15, -pr25, -pr13, -pr23), number - synthetic panel with this number of amplicons. Default: files',default='files')
+    par.add_argument('--reads-number','-n',dest='readsNum',type=int,help='number of read pairs. Default: 20000',default=20000)
+    par.add_argument('--read-length','-len',dest='readLen',type=int,help='length of reads. Default: 150',default=150)
+    par.add_argument('--error-rate','-er',dest='errorRate',type=float,help='probability of error for each nucleotide of primers. Default: 0.02',default=0.02)
+    par.add_argument('--indel-fraction','-indel',dest='indelFraction',type=float,help='part of errors that are insertions or deletions. Default: 0.3',default=0.3)
+    par.add_argument('--no-primer3-fraction','-noprimer3',dest='noPrimer3Fraction',type=float,help='part of reads without primer on the 3\'-end. Default: 0.1',default=0.1)
+    par.add_argument('--dimer-fraction','-dimer',dest='dimerFraction',type=float,help='part of reads that are primer-dimers. Default: 0.05',default=0.05)
+    par.add_argument('--random-fraction','-random',dest='randomFraction',type=float,help='part of reads without primers. Default: 0.05',default=0.05)
+    par.add_argument('--threads','-t',dest='threads',type=str,help='comma-separated list of numbers of threads for cutPrimers.py. Default: 1,2',default='1,2')
+    par.add_argument('--error-number','-err',dest='errNumbers',type=str,help='comma-separated list of values of -err parameter. Default: 5',default='5')
+    par.add_argument('--primer-location-buffer','-plb',dest='primerLocBufs',type=str,help='comma-separated list of values of -plb parameter. Default: 10',default='10')
+    par.add_argument('--input-format','-format',dest='formats',type=str,help='comma-separated list of formats of reads files: plain, gz. Default: plain,gz',default='plain,gz')
+    par.add_argument('--matcher','-matcher',dest='matcherType',type=str,choices=['regex','myers'],help='algorithm for searching primers (see -matcher parameter of cutPrimers.py). Default: regex',default='regex')
+    par.add_argument('--trim-primers-reads','-tpn',dest='trimPrimersReadsNum',type=int,help='number of read pairs for benchmark of function trimPrimers. Use 0 to skip this benchmark. Default: 5000',default=5000)
+    par.add_argument('--repeats','-rep',dest='repeats',type=int,help='number of repeats of each measurement. The best time is used. Default: 1',default=1)
+    par.add_argument('--cutPrimers-args','-args',dest='extraArgs',type=str,help='additional parameters for cutPrimers.py in quotes, e.g. "-bs 5000 -cl 1"',default='')
+    par.add_argument('--seed','-seed',dest='seed',type=int,help='seed for generator of random reads. Default: 1',default=1)
+    par.add_argument('--work-dir','-dir',dest='workDir',type=str,help='directory for reads and output files. Default: benchmark',default='benchmark')
+    par.add_argument('--output','-out',dest='outFile',type=str,help='JSON-file for results. Default: benchmark.json',default='benchmark.json')
+    args=par.parse_args()
+    threadsNums=parseList(args.threads,int)
+    errNumbers=parseList(args.errNumbers,int)
+    primerLocBufs=parseList(args.primerLocBufs,int)
+    formats=parseList(args.formats)
+    for readsFormat in formats:
+        if readsFormat not in ['plain','gz']:
+            print('ERROR: unknown format of reads files:',readsFormat)
+            exit(0)
+    os.makedirs(args.workDir,exist_ok=True)
+    results={'machine':{'python':platform.python_version(),'platform':platform.platform(),'cpus':os.cpu_count()},
+             'parameters':vars(args),'results':[]}
+    for panel in parseList(args.panels):
+        panelDir=os.path.join(args.workDir,'panel_'+panel)
+        os.makedirs(panelDir,exist_ok=True)
+        if panel=='files':
+            primersFiles=[args.primersFileR1_5,args.primersFileR2_5,args.primersFileR1_3,args.primersFileR2_3]
+        else:
+            primersFiles=makePanel(random.Random(args.seed),int(panel),panelDir)
+        amplicons=len(readPrimersSeqs(primersFiles[0])[0])
+        for readsFormat in formats:
+            ext='.fastq.gz' if readsFormat=='gz' else '.fastq'
+            readsFileR1=os.path.join(panelDir,'reads_R1'+ext)
+            readsFileR2=os.path.join(panelDir,'reads_R2'+ext)
+            print('Generating reads for panel',panel,'('+readsFormat+')...')
+            readsTypes=generateReads(primersFiles,readsFileR1,readsFileR2,args.readsNum,args.readLen,args.errorRate,args.indelFraction,
+                                     args.noPrimer3Fraction,args.dimerFraction,args.randomFraction,args.seed)
+            result={'panel':panel,'amplicons':amplicons,'format':readsFormat,'readsTypes':readsTypes}
+            # Speed of trimPrimers does not depend on format of files, so it is measured only once
+            if args.trimPrimersReadsNum>0 and readsFormat==formats[0]:
+                for errNumber,primerLocBuf in product(errNumbers,primerLocBufs):
+                    times=[]
+                    for i in range(args.repeats):
+                        seconds,readsNum,trimmedNum=benchmarkTrimPrimers(primersFiles,readsFileR1,readsFileR2,args.trimPrimersReadsNum,errNumber,primerLocBuf,args.matcherType)
+                        times.append(seconds)
+                    results['results'].append(dict(result,benchmark='trimPrimers',errNumber=errNumber,primerLocBuf=primerLocBuf,
+                                                   reads=readsNum,trimmedReads=trimmedNum,times=times,
+                                                   readsPerSecond=round(readsNum/min(times),1)))
+                    print('trimPrimers','panel='+panel,'err='+str(errNumber),'plb='+str(primerLocBuf),
+                          str(round(readsNum/min(times),1))+' reads/s',sep='\t')
+            for threads,errNumber,primerLocBuf in product(threadsNums,errNumbers,primerLocBufs):
+                times=[]
+                for i in range(args.repeats):
+                    seconds,trimmedNum=benchmarkCli(primersFiles,readsFileR1,readsFileR2,panelDir,threads,errNumber,primerLocBuf,args.matcherType,args.extraArgs.split())
+                    times.append(seconds)
+                results['results'].append(dict(result,benchmark='cli',threads=threads,errNumber=errNumber,primerLocBuf=primerLocBuf,
+                                               reads=args.readsNum,trimmedReads=trimmedNum,times=times,
+                                               readsPerSecond=round(args.readsNum/min(times),1)))
+                print('cli','panel='+panel,'format='+readsFormat,'t='+str(threads),'err='+str(errNumber),'plb='+str(primerLocBuf),
+                      str(round(args.readsNum/min(times),1))+' reads/s',sep='\t')
+    file=open(args.outFile,'w')
+    json.dump(results,file,indent=1)
+    file.write('\n')
+    file.close()
+    print('Results were written to',args.outFile)
@@ -8,41 +8,708 @@ import sys
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio import pairwise2
+from Bio import bgzf
 import glob,gzip
+import io,os,zlib,struct
+import threading,queue
 import regex
 import time
 from multiprocessing import Pool,Queue
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque,Counter,OrderedDict
 import argparse
 import time,math
-from itertools import repeat
+from itertools import repeat,islice
 from operator import itemgetter
+import functools
 import hashlib
+import pickle
+import json
+try:
+    import numpy as np
+except ImportError:
+    np=None
+
+# Codes of nucleotides for making hashes of sequence parts
+nucCodes={'A':0,'C':1,'G':2,'T':3}
 
 def makeHashes(seq,k):
     # k is the length of parts
-    subSeqs=[]
+    # Each part is coded by an integer with 2 bits per nucleotide and one additional leading bit,
+    # so parts of different lengths always have different codes. Codes are calculated in a rolling manner
+    # Parts that contain letters other than A, C, G and T are saved as strings
     h=[]
     lens=set([k])
-    for i in range(len(seq)-k+1):
-        h.append(hashlib.md5(seq[i:i+k].encode('utf-8')).hexdigest())
+    if k<1:
+        return([1]*(len(seq)+1),lens)
+    mask=(1<<(2*k))-1
+    leadingBit=1<<(2*k)
+    code=0
+    goodLen=0
+    for i,c in enumerate(seq):
+        n=nucCodes.get(c)
+        if n is None:
+            goodLen=0
+        else:
+            code=((code<<2)|n)&mask
+            goodLen+=1
+        if i>=k-1:
+            if goodLen>=k:
+                h.append(code|leadingBit)
+            else:
+                h.append(seq[i-k+1:i+1])
     return(h,lens)
 
-def initializer(maxPrimerLen2,primerLocBuf2,errNumber2,primersR1_52,primersR1_32,primersR2_52,primersR2_32,
-                primerR1_5_hashes2,primerR1_5_hashLens2,primerR2_5_hashes2,primerR2_5_hashLens2,
-                primersFileR1_32,primersFileR2_52,primersFileR2_32,readsFileR22,primersStatistics2,idimer2,primer3absent2,minPrimer3Len2):
+def findCandidatePrimers(seq,primerHashes,primerHashLens):
+    # This function finds primers that have the most common parts with the sequence
+    # primerHashes - dictionary with hashes of primers parts as keys and lists of primers numbers as values
+    # primerHashLens - lengths of primers parts
+    # It returns number of the best primer (or None) and list of numbers of primers
+    # that have at most one common part less than the best one
+    readHashes=set()
+    for l in primerHashLens:
+        hashes,lens=makeHashes(seq,l)
+        readHashes.update(hashes)
+    matchedPrimers={}
+    for rh in primerHashes.keys()&readHashes:
+        for a in primerHashes[rh]:
+            if a not in matchedPrimers.keys():
+                matchedPrimers[a]=1
+            else:
+                matchedPrimers[a]+=1
+    bestPrimer=None
+    bestPrimerValue=None
+    goodPrimerNums=[]
+    # If several primers have the same number of common parts, primer with smaller number goes first
+    for key,item in sorted(matchedPrimers.items(),key=lambda x:(-x[1],x[0])):
+        if bestPrimer==None:
+            bestPrimer=key
+            bestPrimerValue=item
+            continue
+        if item>=bestPrimerValue-1:
+            goodPrimerNums.append(key)
+        else: break
+    return(bestPrimer,goodPrimerNums)
+
+def makeHashArrays(primerHashes,primerHashLens):
+    # This function converts dictionary with hashes of primers parts to numpy arrays
+    # for searching candidate primers for many reads at once (see findCandidatePrimersBatch)
+    # It returns dictionary with sorted unique hashes (hashes), start and end of the list of primers
+    # for each hash (starts and ends), numbers of primers (primerNums) and lengths of parts (lens)
+    # If numpy is not installed or some hashes can not be used (see makeHashes), it returns None
+    if np is None or len(primerHashes)==0:
+        return(None)
+    if min(primerHashLens)<1 or max(primerHashLens)>31:
+        return(None)
+    if any(type(h)!=int for h in primerHashes.keys()):
+        return(None)
+    hashes=sorted(primerHashes.keys())
+    lens=np.array([len(primerHashes[h]) for h in hashes],dtype=np.int64)
+    ends=np.cumsum(lens)
+    primerNums=[]
+    for h in hashes:
+        primerNums.extend(primerHashes[h])
+    return({'hashes':np.array(hashes,dtype=np.int64),'starts':ends-lens,'ends':ends,
+            'primerNums':np.array(primerNums,dtype=np.int64),'lens':sorted(primerHashLens)})
+
+# Table for converting letters of reads to codes of nucleotides. All letters except A, C, G and T get code 4
+if np is not None:
+    nucCodesTable=np.full(256,4,dtype=np.int64)
+    for nuc,code in nucCodes.items():
+        nucCodesTable[ord(nuc)]=code
+
+def findCandidatePrimersBatch(seqs,hashArrays,seqLen):
+    # This function does the same as findCandidatePrimers but for many sequences at once
+    # seqs - list of sequences, from each of them only the first seqLen letters are used
+    # hashArrays - result of makeHashArrays
+    # It returns list with the best primer and list of good primers for each sequence
+    readsNum=len(seqs)
+    if readsNum==0:
+        return([])
+    # Code all sequences to the matrix. Short sequences are supplemented with code 4
+    text=''.join(seq[:seqLen].ljust(seqLen,'N') for seq in seqs).encode('ascii','replace')
+    seqCodes=nucCodesTable[np.frombuffer(text,dtype=np.uint8)].reshape(readsNum,seqLen)
+    # Calculate hashes of all parts (see makeHashes). Parts with letters other than A, C, G and T get 0
+    readHashes=[]
+    for k in hashArrays['lens']:
+        partsNum=seqLen-k+1
+        if partsNum<1:
+            continue
+        codes=np.zeros((readsNum,partsNum),dtype=np.int64)
+        good=np.ones((readsNum,partsNum),dtype=bool)
+        for j in range(k):
+            part=seqCodes[:,j:j+partsNum]
+            codes=(codes<<2)|(part&3)
+            good&=part<4
+        readHashes.append(np.where(good,codes|(1<<(2*k)),0))
+    if len(readHashes)==0:
+        return([(None,[])]*readsNum)
+    # Leave only unique hashes of each sequence
+    readHashes=np.sort(np.concatenate(readHashes,axis=1),axis=1)
+    unique=readHashes!=0
+    unique[:,1:]&=readHashes[:,1:]!=readHashes[:,:-1]
+    rows=np.nonzero(unique)[0]
+    readHashes=readHashes[unique]
+    # Find hashes in the index of primers
+    hashes=hashArrays['hashes']
+    pos=np.searchsorted(hashes,readHashes)
+    pos[pos==len(hashes)]=0
+    found=hashes[pos]==readHashes
+    rows=rows[found]
+    pos=pos[found]
+    # Each found hash gives one vote to each primer from its list
+    lens=hashArrays['ends'][pos]-hashArrays['starts'][pos]
+    rows=np.repeat(rows,lens)
+    shifts=np.arange(len(rows))-np.repeat(np.cumsum(lens)-lens,lens)
+    primers=hashArrays['primerNums'][np.repeat(hashArrays['starts'][pos],lens)+shifts]
+    primersNum=int(hashArrays['primerNums'].max())+1
+    pairs,votes=np.unique(rows*primersNum+primers,return_counts=True)
+    rows=pairs//primersNum
+    primers=pairs%primersNum
+    # Sort primers of each sequence by number of votes, and after that by number of primer
+    order=np.lexsort((primers,-votes,rows))
+    rows=rows[order].tolist(); primers=primers[order].tolist(); votes=votes[order].tolist()
+    result=[(None,[])]*readsNum
+    i=0
+    while i<len(rows):
+        row=rows[i]
+        bestPrimer=primers[i]
+        bestPrimerValue=votes[i]
+        goodPrimerNums=[]
+        i+=1
+        while i<len(rows) and rows[i]==row:
+            if votes[i]>=bestPrimerValue-1:
+                goodPrimerNums.append(primers[i])
+            i+=1
+        result[row]=(bestPrimer,goodPrimerNums)
+    return(result)
+
+def makePeq(seq):
+    # This function makes bit-vectors of letters positions in the sequence for myersDistance
+    peq={}
+    for i,c in enumerate(seq):
+        peq[c]=peq.get(c,0)|(1<<i)
+    return(peq)
+
+def myersDistance(peq,seqLen,text,prefixes=False,ends=False):
+    # This function calculates the minimal edit distance between sequence and any part of the text
+    # with bit-parallel algorithm of Myers (1999)
+    # peq - bit-vectors of letters in the sequence (see makePeq)
+    # seqLen - length of the sequence
+    # prefixes - if True, it also returns list of the minimal edit distances between each prefix of the sequence
+    # (from empty one) and any part of the text at its end. They are calculated from the last column of vertical differences
+    # ends - if True, it also returns list of positions of the text after parts of the text with the minimal edit distance
+    mask=(1<<seqLen)-1
+    highBit=1<<(seqLen-1)
+    pv=mask
+    mv=0
+    score=seqLen
+    minScore=score
+    # endsScore - the minimal edit distance among parts of the text that end at positions minEnds
+    endsScore=score
+    minEnds=[0]
+    for pos,c in enumerate(text,1):
+        eq=peq.get(c,0)
+        xv=eq|mv
+        xh=(((eq&pv)+pv)^pv)|eq
+        ph=mv|(~(xh|pv)&mask)
+        mh=pv&xh
+        if ph&highBit:
+            score+=1
+        elif mh&highBit:
+            score-=1
+            if score<minScore:
+                minScore=score
+        ph=(ph<<1)&mask
+        mh=(mh<<1)&mask
+        pv=mh|(~(xv|ph)&mask)
+        mv=ph&xv
+        if ends:
+            if score<endsScore:
+                endsScore=score
+                minEnds=[pos]
+            elif score==endsScore:
+                minEnds.append(pos)
+    if ends:
+        return(minScore,minEnds)
+    if not prefixes:
+        return(minScore)
+    prefixDistances=[0]
+    for i in range(seqLen):
+        prefixDistances.append(prefixDistances[-1]+((pv>>i)&1)-((mv>>i)&1))
+    return(minScore,prefixDistances)
+
+class PrimerLocator:
+    # This class finds candidate primers in a sequence with Aho-Corasick automaton
+    # Automaton is built once for parts of all primers. Parts are the same as for hashes (see readPrimersFile):
+    # all parts of primer with length len(primer)//(errNumber+1)
+    # All occurrences of all parts are found during one scan of the sequence. Each occurrence shows
+    # where primer should begin in the sequence (diagonal). Votes of primer are the largest number of its parts
+    # found on the same diagonal, so parts of other primers that are found by chance give them only few votes
+    # seqs - sequences of primers, errNumbers - maximal numbers of errors for them
+    # seqLen - length of sequences in which primers are searched. Longer sequences are cut
+    def __init__(self,seqs,errNumbers,seqLen):
+        # Each found part is coded by one integer: number of primer*diagonalsNum+diagonal+maxPrimerLen
+        maxPrimerLen=max(len(seq) for seq in seqs)
+        self.seqLen=seqLen
+        self.diagonalsNum=seqLen+maxPrimerLen+1
+        goto=[{}]
+        out=[[]]
+        for primerNum,(seq,errNumber) in enumerate(zip(seqs,errNumbers)):
+            partLen=max(len(seq)//(errNumber+1),1)
+            for partStart in range(len(seq)-partLen+1):
+                node=0
+                for c in seq[partStart:partStart+partLen]:
+                    if c not in goto[node].keys():
+                        goto[node][c]=len(goto)
+                        goto.append({})
+                        out.append([])
+                    node=goto[node][c]
+                # Part that ends at the position i of sequence gives diagonal i-partLen+1-partStart
+                out[node].append(primerNum*self.diagonalsNum+maxPrimerLen-partLen+1-partStart)
+        # Make transitions for all letters, so failure links are not needed during scanning
+        # Nodes are processed in the order of their depth, so transitions of failure node are already made
+        letters=set(c for seq in seqs for c in seq)
+        fail=[0]*len(goto)
+        self.transitions=[None]*len(goto)
+        self.transitions[0]={c:goto[0].get(c,0) for c in letters}
+        nodes=deque(goto[0].values())
+        while nodes:
+            node=nodes.popleft()
+            self.transitions[node]={}
+            for c in letters:
+                if c in goto[node].keys():
+                    child=goto[node][c]
+                    fail[child]=self.transitions[fail[node]][c]
+                    out[child]=out[child]+out[fail[child]]
+                    self.transitions[node][c]=child
+                    nodes.append(child)
+                else:
+                    self.transitions[node][c]=self.transitions[fail[node]][c]
+        if np is not None:
+            self.out=[np.array(o,dtype=np.int64) if o else None for o in out]
+        else:
+            self.out=[o if o else None for o in out]
+
+    def locate(self,seq):
+        # Find all parts of primers in the sequence
+        # It returns list of codes of found parts, each of them is shifted by its position in the sequence
+        found=[]
+        node=0
+        transitions=self.transitions
+        out=self.out
+        for i,c in enumerate(seq[:self.seqLen]):
+            node=transitions[node].get(c,0)
+            if out[node] is not None:
+                if np is not None:
+                    found.append(out[node]+i)
+                else:
+                    found.extend(code+i for code in out[node])
+        return(found)
+
+    def findCandidatePrimers(self,seq):
+        # This function does the same as findCandidatePrimers but votes are counted by diagonals
+        # It returns number of the best primer (or None) and list of numbers of primers
+        # that have at most one vote less than the best one
+        found=self.locate(seq)
+        if len(found)==0:
+            return(None,[])
+        if np is not None:
+            codes,counts=np.unique(np.concatenate(found),return_counts=True)
+            primers=codes//self.diagonalsNum
+            starts=np.concatenate(([0],np.flatnonzero(primers[1:]!=primers[:-1])+1))
+            primers=primers[starts]
+            votes=np.maximum.reduceat(counts,starts)
+            good=votes>=votes.max()-1
+            primers=primers[good]
+            votes=votes[good]
+            order=np.lexsort((primers,-votes))
+            primerNums=primers[order].tolist()
+        else:
+            votes={}
+            for code,count in Counter(found).items():
+                primerNum=code//self.diagonalsNum
+                if count>votes.get(primerNum,0):
+                    votes[primerNum]=count
+            bestVotes=max(votes.values())
+            primerNums=sorted((primerNum for primerNum,count in votes.items() if count>=bestVotes-1),key=lambda x:(-votes[x],x))
+        return(primerNums[0],primerNums[1:])
+
+class Profile:
+    # This class collects timers and counters of stages of trimming (see parameter --profile)
+    # Each process collects its own values. They are sent to the main process with results of batches (see take)
+    # and are summed there (see merge), so time of stages is the sum of time of all processes
+    def __init__(self):
+        # stages - {stage: [time in seconds, number of calls]}
+        # counters - {name: value}
+        # primers - {(stage, number of primer): [time in seconds, number of searches, number of matches]}
+        self.stages={}
+        self.counters={}
+        self.primers={}
+
+    def addTime(self,stage,seconds,calls=1):
+        if stage not in self.stages.keys():
+            self.stages[stage]=[0,0]
+        self.stages[stage][0]+=seconds
+        self.stages[stage][1]+=calls
+
+    def count(self,name,value=1):
+        self.counters[name]=self.counters.get(name,0)+value
+
+    def addPrimerSearch(self,stage,primerNum,seconds,found):
+        self.addTime(stage,seconds)
+        if (stage,primerNum) not in self.primers.keys():
+            self.primers[(stage,primerNum)]=[0,0,0]
+        primerValues=self.primers[(stage,primerNum)]
+        primerValues[0]+=seconds
+        primerValues[1]+=1
+        primerValues[2]+=found
+
+    def timed(self,stage,function):
+        # Returns function that does the same as function, but its time is added to the stage
+        @functools.wraps(function)
+        def timedFunction(*args,**kwargs):
+            start=time.perf_counter()
+            try:
+                return(function(*args,**kwargs))
+            finally:
+                self.addTime(stage,time.perf_counter()-start)
+        return(timedFunction)
+
+    def take(self):
+        # Returns collected values as a new object and starts collecting from zero
+        profile=Profile()
+        profile.stages,profile.counters,profile.primers=self.stages,self.counters,self.primers
+        self.stages={}; self.counters={}; self.primers={}
+        return(profile)
+
+    def merge(self,other):
+        for stage,(seconds,calls) in other.stages.items():
+            self.addTime(stage,seconds,calls)
+        for name,value in other.counters.items():
+            self.count(name,value)
+        for key,values in other.primers.items():
+            if key not in self.primers.keys():
+                self.primers[key]=[0,0,0]
+            for i,value in enumerate(values):
+                self.primers[key][i]+=value
+
+    def write(self,fileName,readsNum,wallTime,primersNames):
+        # Write report to JSON-file (if name of file ends with .json) or to tab-separated file
+        # readsNum - number of processed reads (or read pairs), wallTime - time of the whole run
+        # primersNames - {stage: list of names of primers}
+        report={'reads':readsNum,'wallTime':round(wallTime,3),
+                'readsPerSecond':round(readsNum/wallTime,1) if wallTime>0 else None,
+                'stages':{},'counters':dict(sorted(self.counters.items())),'primers':[]}
+        for stage,(seconds,calls) in sorted(self.stages.items(),key=lambda x:-x[1][0]):
+            report['stages'][stage]={'time':round(seconds,3),'calls':calls,
+                                     'readsPerSecond':round(readsNum/seconds,1) if seconds>0 else None}
+        for (stage,primerNum),(seconds,searches,matches) in sorted(self.primers.items(),key=lambda x:(x[0][0],-x[1][0])):
+            names=primersNames.get(stage)
+            report['primers'].append({'primer':names[primerNum] if names else primerNum,'stage':stage,
+                                      'time':round(seconds,6),'searches':searches,'matches':matches,
+                                      'searchesPerSecond':round(searches/seconds,1) if seconds>0 else None})
+        file=open(fileName,'w')
+        if fileName.endswith('.json'):
+            json.dump(report,file,indent=1)
+            file.write('\n')
+        else:
+            file.write('\t'.join(['Reads','Wall time (s)','Reads per second'])+'\n')
+            file.write('\t'.join(map(str,[report['reads'],report['wallTime'],report['readsPerSecond']]))+'\n\n')
+            file.write('\t'.join(['Stage','Time (s)','Calls','Reads per second'])+'\n')
+            for stage,values in report['stages'].items():
+                file.write('\t'.join(map(str,[stage,values['time'],values['calls'],values['readsPerSecond']]))+'\n')
+            file.write('\n'+'\t'.join(['Counter','Value'])+'\n')
+            for name,value in report['counters'].items():
+                file.write(name+'\t'+str(value)+'\n')
+            file.write('\n'+'\t'.join(['Primer','Stage','Time (s)','Searches','Matches','Searches per second'])+'\n')
+            for values in report['primers']:
+                file.write('\t'.join(map(str,[values['primer'],values['stage'],values['time'],values['searches'],
+                                              values['matches'],values['searchesPerSecond']]))+'\n')
+        file.close()
+
+class ExactMatch:
+    # Match of primer without errors
+    # It has the same methods as match of regular expression that are used for trimming (span and getting of matched sequence)
+    __slots__=('seq','start','end')
+    def __init__(self,seq,start):
+        self.seq=seq
+        self.start=start
+        self.end=start+len(seq)
+
+    def span(self):
+        return((self.start,self.end))
+
+    def __getitem__(self,groupNum):
+        return(self.seq)
+
+class PrimerMatcher:
+    # This class keeps compiled regular expressions for searching primers of one type
+    # (e.g. primers on the 5'-end of R1 reads) in read sequences
+    # It is created once in each process, so regular expressions are not built for each read
+    # primers - list of primer sequences in brackets (as they are read from fasta-file)
+    # errNumber - maximal number of errors during searching primer sequence
+    # minPrimer3Len - if it is determined and primer is not found, its prefixes are searched at the end of the sequence
+    # from the longest one down to minPrimer3Len letters. Number of errors is decreased proportionally to the part of primer used
+    # matcherType - 'regex' or 'myers'. In the last case the minimal number of errors is calculated
+    # with bit-parallel algorithm of Myers before searching with regular expression. If it is larger
+    # than errNumber, regular expression is not used at all. Else regular expression is used with
+    # this number of errors, that gives the same match but much faster
+    # alternationCacheSize - number of compiled regular expressions for groups of primers that are kept
+    # Before fuzzy search, primer is searched without errors (see search and searchExact).
+    # Regular expression with BESTMATCH flag gives the same match in this case, because match without errors is the best one
+    # locatorType - 'hash' or 'aho'. In the last case, if primer is searched, at first it is checked that at least one of
+    # errNumber+1 parts of primer is present in the sequence. If primer is present with not more than errNumber errors,
+    # at least one of its parts does not have errors. Several primers are searched one by one instead of one regular expression
+    # seqLen - if it is determined and locatorType is 'aho', candidate primers are found with PrimerLocator for sequences of this length
+    # locator - PrimerLocator that has been already made for these primers and seqLen (see makePrimerLocators). If it is None, it is made here
+    # name - name of primers type for profile report, profile - object of Profile class or None
+    def __init__(self,primers,errNumber,minPrimer3Len=None,matcherType='regex',alternationCacheSize=1024,
+                 locatorType='hash',seqLen=None,name='',profile=None,overlap=False,locator=None):
+        self.primers=primers
+        self.errNumber=errNumber
+        self.matcherType=matcherType
+        # seqs - sequences that are searched, errNumbers - maximal numbers of errors for them
+        self.seqs=[primer[1:-1] for primer in primers]
+        self.errNumbers=[int(errNumber)]*len(primers)
+        # prefixes - if minPrimer3Len is determined, prefixes of each primer from the longest one down to minPrimer3Len letters
+        # with their maximal numbers of errors
+        # Regular expressions for prefixes are compiled once, when they are needed at first (see compilePrefixPattern)
+        self.prefixes=None
+        if minPrimer3Len:
+            self.prefixes=[[(seq[:prefixLen],int(round(int(errNumber)*prefixLen/len(seq))))
+                            for prefixLen in range(len(seq)-1,minPrimer3Len-1,-1)] for seq in self.seqs]
+        # exactSeqs - {sequence: number of primer}, exactLens - lengths of sequences from the longest one
+        # If there are several primers with the same sequence, the first of them is used
+        self.exactSeqs={}
+        for i,seq in enumerate(self.seqs):
+            if seq not in self.exactSeqs.keys():
+                self.exactSeqs[seq]=i
+        self.exactLens=sorted(set(len(seq) for seq in self.seqs),reverse=True)
+        # seedParts - errNumber+1 parts of each sequence. If sequence is too short for this, it is None
+        self.locatorType=locatorType
+        self.locator=None
+        if locatorType=='aho':
+            self.seedParts=[]
+            for seq,e in zip(self.seqs,self.errNumbers):
+                partLen=len(seq)//(e+1)
+                if partLen>0:
+                    self.seedParts.append([seq[i*partLen:(i+1)*partLen] for i in range(e+1)])
+                else:
+                    self.seedParts.append(None)
+            if locator is not None:
+                self.locator=locator
+            elif seqLen:
+                self.locator=PrimerLocator(self.seqs,self.errNumbers,seqLen)
+        self.compilePattern=functools.lru_cache(maxsize=None)(self._compilePattern)
+        self.compileAlternation=functools.lru_cache(maxsize=alternationCacheSize)(self._compileAlternation)
+        self.compilePrefixPattern=functools.lru_cache(maxsize=None)(self._compilePrefixPattern)
+        if matcherType=='myers' or minPrimer3Len or overlap:
+            self.peqs=[makePeq(seq) for seq in self.seqs]
+        # reversePeqs - bit-vectors of reversed primers for searching primers by primers of other reads (see searchMate)
+        if overlap:
+            self.reversePeqs=[makePeq(seq[::-1]) for seq in self.seqs]
+        if matcherType!='myers':
+            self.patterns=[self.compilePattern(i,e) for i,e in enumerate(self.errNumbers)]
+        # If profile is collected, searching methods are replaced with methods that also measure their time
+        self.name=name
+        self.profile=profile
+        if profile is not None:
+            self.findPrimer=self.search
+            self.findAnyPrimer=self.searchAny
+            self.findExactPrimer=self.searchExact
+            self.search=self.profiledSearch
+            self.searchAny=self.profiledSearchAny
+            self.searchExact=self.profiledSearchExact
+
+    def _compilePattern(self,primerNum,errNumber):
+        return(regex.compile(r'(?:('+self.seqs[primerNum]+')){e<='+str(errNumber)+'}',flags=regex.BESTMATCH))
+
+    def _compilePrefixPattern(self,primerNum,prefixNum,errNumber):
+        # Prefix of primer is searched only at the end of the sequence
+        return(regex.compile(r'(?:('+self.prefixes[primerNum][prefixNum][0]+')){e<='+str(errNumber)+'}$',flags=regex.BESTMATCH))
+
+    def _compileAlternation(self,primerNums,errNumber):
+        return(regex.compile(r'(?:'+'|'.join(self.primers[i] for i in primerNums)+'){e<='+str(errNumber)+'}',flags=regex.BESTMATCH))
+
+    def distance(self,primerNum,seq):
+        # Minimal number of errors between primer and any part of the sequence
+        if len(self.seqs[primerNum])==0:
+            return(0)
+        return(myersDistance(self.peqs[primerNum],len(self.seqs[primerNum]),seq))
+
+    def searchExact(self,seq):
+        # Search any primer without errors in the sequence
+        # Parts of sequence are looked for in the dictionary of primers sequences
+        # from the beginning of sequence and from the longest primers
+        # If something is found, it returns match and number of found primer
+        for start in range(len(seq)-self.exactLens[-1]+1):
+            for seqLen in self.exactLens:
+                if start+seqLen<=len(seq):
+                    primerNum=self.exactSeqs.get(seq[start:start+seqLen])
+                    if primerNum is not None:
+                        return(ExactMatch(self.seqs[primerNum],start),primerNum)
+        return(None,None)
+
+    def search(self,primerNum,seq):
+        # Search one primer in the sequence
+        # If prefixes of primers are determined (minPrimer3Len), they are searched too (see searchPrefix)
+        if self.prefixes is None:
+            return(self.searchPrimer(primerNum,seq))
+        return(self.searchPrefix(primerNum,seq))
+
+    def searchPrefix(self,primerNum,seq):
+        # Search whole primer in the sequence. If it is not found, search its prefixes at the end of the sequence
+        # from the longest one (see prefixes)
+        # Numbers of errors of primer and of all its prefixes are calculated with one pass of algorithm of Myers (see myersDistance),
+        # so regular expression is used only for primer or prefix that is present, with the found number of errors
+        start=seq.find(self.seqs[primerNum])
+        if start!=-1:
+            return(ExactMatch(self.seqs[primerNum],start))
+        dist,prefixDistances=myersDistance(self.peqs[primerNum],len(self.seqs[primerNum]),seq,True)
+        if dist<=self.errNumbers[primerNum]:
+            return(self.compilePattern(primerNum,dist).search(seq))
+        for prefixNum,(prefix,e) in enumerate(self.prefixes[primerNum]):
+            dist=prefixDistances[len(prefix)]
+            if dist==0:
+                return(ExactMatch(prefix,len(seq)-len(prefix)))
+            if dist<=e:
+                return(self.compilePrefixPattern(primerNum,prefixNum,dist).search(seq))
+        return(None)
+
+    def searchMate(self,primerNum,seq,mateSeq):
+        # Search primer in the sequence by the sequence of the same primer found at the 5'-end of the other read (see parameter -overlap)
+        # If reads overlap, both of them contain the same copy of primer, so the sequence usually contains
+        # its reverse complement sequence with the same synthesis errors. It is searched without errors
+        # Found part of the sequence is used only if fuzzy search can find only it: the minimal number of errors of primer
+        # in the sequence is not more than errNumber, and it is reached only by parts of the sequence that end at the end
+        # of the found part and only by parts that begin at its beginning (see myersDistance, the last is checked
+        # for reversed primer and sequence). Any match with the minimal number of errors has the same beginning and end
+        # It returns ExactMatch or None. If None is returned, primer should be searched as usual
+        primerSeq=revComplement(mateSeq)
+        start=seq.find(primerSeq)
+        if start==-1:
+            return(None)
+        seqLen=len(self.seqs[primerNum])
+        dist,ends=myersDistance(self.peqs[primerNum],seqLen,seq,ends=True)
+        if dist>self.errNumbers[primerNum] or ends!=[start+len(primerSeq)]:
+            return(None)
+        dist,starts=myersDistance(self.reversePeqs[primerNum],seqLen,seq[::-1],ends=True)
+        if starts!=[len(seq)-start]:
+            return(None)
+        return(ExactMatch(primerSeq,start))
+
+    def searchPrimer(self,primerNum,seq):
+        # Search whole primer in the sequence
+        # At first, primer is searched without errors
+        start=seq.find(self.seqs[primerNum])
+        if start!=-1:
+            return(ExactMatch(self.seqs[primerNum],start))
+        if self.locatorType=='aho' and self.seedParts[primerNum] is not None:
+            if not any(part in seq for part in self.seedParts[primerNum]):
+                return(None)
+        if self.matcherType=='myers':
+            dist=self.distance(primerNum,seq)
+            if dist>self.errNumbers[primerNum]:
+                return(None)
+            return(self.compilePattern(primerNum,dist).search(seq))
+        return(self.patterns[primerNum].search(seq))
+
+    def searchAny(self,primerNums,seq):
+        # Search any of several primers in the sequence
+        # If something is found, it returns match and number of found primer
+        if self.locatorType=='aho':
+            return(self.searchEach(primerNums,seq))
+        if self.matcherType=='myers':
+            dist=min(self.distance(i,seq) for i in primerNums)
+            if dist>int(self.errNumber):
+                return(None,None)
+            m=self.compileAlternation(tuple(primerNums),dist).search(seq)
+        else:
+            m=self.compileAlternation(tuple(primerNums),self.errNumber).search(seq)
+        if m==None:
+            return(None,None)
+        return(m,primerNums[list(m.groups()).index(m[0])])
+
+    def searchEach(self,primerNums,seq):
+        # Search several primers in the sequence one by one and choose match with the smallest number of errors
+        # If numbers of errors are equal, match that begins earlier is chosen, and after that primer that goes earlier in the list
+        bestMatch=None
+        bestPrimerNum=None
+        bestScore=None
+        for primerNum in primerNums:
+            m=PrimerMatcher.searchPrimer(self,primerNum,seq)
+            if m is None:
+                continue
+            if isinstance(m,ExactMatch):
+                score=(0,m.span()[0])
+            else:
+                score=(sum(m.fuzzy_counts),m.span()[0])
+            if bestScore is None or score<bestScore:
+                bestMatch,bestPrimerNum,bestScore=m,primerNum,score
+        return(bestMatch,bestPrimerNum)
+
+    def profiledSearch(self,primerNum,seq):
+        start=time.perf_counter()
+        m=self.findPrimer(primerNum,seq)
+        self.profile.addPrimerSearch('search '+self.name,primerNum,time.perf_counter()-start,m is not None)
+        if isinstance(m,ExactMatch):
+            self.profile.count(self.name+' found by exact match')
+        else:
+            # Matcher of Myers does not use regular expression only if primer is not found
+            if self.matcherType=='regex' or m is not None:
+                self.profile.count('regex calls')
+            if m is not None:
+                self.profile.count(self.name+' found by fuzzy search')
+        return(m)
+
+    def profiledSearchExact(self,seq):
+        start=time.perf_counter()
+        m,primerNum=self.findExactPrimer(seq)
+        self.profile.addTime('search exact '+self.name,time.perf_counter()-start)
+        if m is not None:
+            self.profile.count(self.name+' found by exact match')
+        return(m,primerNum)
+
+    def profiledSearchAny(self,primerNums,seq):
+        start=time.perf_counter()
+        m,primerNum=self.findAnyPrimer(primerNums,seq)
+        self.profile.addTime('search any '+self.name,time.perf_counter()-start)
+        self.profile.count('fallback alternation searches')
+        if self.matcherType=='regex' or m is not None:
+            self.profile.count('regex calls')
+        if m is not None:
+            self.profile.count('fallback alternation hits')
+            self.profile.count(self.name+' found by fuzzy search')
+        return(m,primerNum)
+
+def initializer(primerIndex,primerLocBuf2,errNumber2,
+                primersFileR1_32,primersFileR2_52,primersFileR2_32,readsFileR22,primersStatistics2,idimer2,primer3absent2,minPrimer3Len2,matcherType,untrimmedToTrimmed2,profiling=False,locatorType='hash',alignmentCacheSize=65536,
+                splitAmplicons2=False,overlap=False):
+    # primerIndex - index of primers (see readPrimers)
+    # untrimmedToTrimmed2 - two values that show if untrimmed R1 and R2 reads are written to the same files as trimmed reads
+    # profiling - if True, timers and counters of stages are collected (see Profile)
+    # locatorType - 'hash' or 'aho' (see PrimerMatcher)
+    # alignmentCacheSize - number of results of alignments of primers (countDifs, getErrors, checkSynthesisError, isPrimerDimer)
+    # that are kept in cache of each process. If it is 0, results are not kept
+    # splitAmplicons2 - if True, trimmed reads of each amplicon are returned separately (see trimBatch)
+    # overlap - if True, primers at the 3'-ends are searched at first by primers found at the 5'-ends of other reads (see PrimerMatcher.searchMate)
     global primersR1_5,primersR1_3,primersR2_5,primersR2_3,primersFileR1_3,primersFileR2_3,primersFileR2_5,readsFileR2
     global trimmedReadsR1,trimmedReadsR2,untrimmedReadsR1,untrimmedReadsR2
     global maxPrimerLen,q4,errNumber,primerLocBuf,readsPrimerNum,primersStatistics
-    global primerR1_5_hashes,primerR2_5_hashes,primerR1_5_hashLens,primerR2_5_hashLens,primer3absent,idimer
-    maxPrimerLen=maxPrimerLen2
+    global primerR1_5_hashes,primerR2_5_hashes,primerR1_5_hashLens,primerR2_5_hashLens,primer3absent,idimer,minPrimer3Len
+    global matcherR1_5,matcherR1_3,matcherR2_5,matcherR2_3,primerR1_5_hashArrays,untrimmedToTrimmed
+    global profile,trimPrimers,findCandidatePrimers,countDifs,getErrors,checkSynthesisError,isPrimerDimer
+    global alignmentCaches,alignmentCacheCounts,chunkFiles,splitAmplicons,overlapPrimersR1_3,overlapPrimersR2_3
+    maxPrimerLen=primerIndex['maxPrimerLen']
     primerLocBuf=primerLocBuf2
     errNumber=errNumber2
-    primersR1_5=primersR1_52
-    primersR1_3=primersR1_32
-    primersR2_5=primersR2_52
-    primersR2_3=primersR2_32
-    primerR1_5_hashes=primerR1_5_hashes2; primerR1_5_hashLens=primerR1_5_hashLens2;
-    primerR2_5_hashes=primerR2_5_hashes2; primerR2_5_hashLens=primerR2_5_hashLens2
+    primersR1_5=primerIndex['primersR1_5']
+    primersR1_3=primerIndex['primersR1_3']
+    primersR2_5=primerIndex['primersR2_5']
+    primersR2_3=primerIndex['primersR2_3']
+    primerR1_5_hashes=primerIndex['primerR1_5_hashes']; primerR1_5_hashLens=primerIndex['primerR1_5_hashLens']
+    primerR2_5_hashes=primerIndex['primerR2_5_hashes']; primerR2_5_hashLens=primerIndex['primerR2_5_hashLens']
     primersFileR1_3=primersFileR1_32
     primersFileR2_5=primersFileR2_52
     primersFileR2_3=primersFileR2_32
@@ -51,13 +718,698 @@ def initializer(maxPrimerLen2,primerLocBuf2,errNumber2,primersR1_52,primersR1_32
     idimer=idimer2
     primer3absent=primer3absent2
     minPrimer3Len=minPrimer3Len2
+    untrimmedToTrimmed=untrimmedToTrimmed2
+    splitAmplicons=splitAmplicons2
+    # overlapPrimersR1_3 and overlapPrimersR2_3 - numbers of primers at the 3'-ends that are reverse complement
+    # to primers at the 5'-ends of other reads. Only they can be found by primers of other reads
+    overlapPrimersR1_3=set()
+    overlapPrimersR2_3=set()
+    if overlap and primersR2_5:
+        if primersR1_3:
+            overlapPrimersR1_3={i for i,primer in enumerate(primersR1_3) if primer[1:-1]==revComplement(primersR2_5[i][1:-1])}
+        if primersR2_3:
+            overlapPrimersR2_3={i for i,primer in enumerate(primersR2_3) if primer[1:-1]==revComplement(primersR1_5[i][1:-1])}
+    # Files of reads that are read by chunks (see readChunk)
+    chunkFiles={}
+    # Functions are made again from original functions, so caches of the previous call (e.g. with other errNumber) are not used
+    trimPrimers=originalFunctions['trimPrimers']
+    findCandidatePrimers=originalFunctions['findCandidatePrimers']
+    countDifs=originalFunctions['countDifs']
+    getErrors=originalFunctions['getErrors']
+    checkSynthesisError=originalFunctions['checkSynthesisError']
+    isPrimerDimer=originalFunctions['isPrimerDimer']
+    # The same sequences of primers are found in many reads, so results of their alignments are kept in cache
+    # alignmentCacheCounts - numbers of hits and misses of caches that have been already sent to the main process
+    alignmentCaches=[]
+    alignmentCacheCounts=[0,0]
+    if alignmentCacheSize>0:
+        countDifs=functools.lru_cache(maxsize=alignmentCacheSize)(countDifs)
+        getErrors=functools.lru_cache(maxsize=alignmentCacheSize)(getErrors)
+        checkSynthesisError=functools.lru_cache(maxsize=alignmentCacheSize)(checkSynthesisError)
+        isPrimerDimer=functools.lru_cache(maxsize=alignmentCacheSize)(isPrimerDimer)
+        alignmentCaches=[countDifs,getErrors,checkSynthesisError,isPrimerDimer]
+    if profiling:
+        profile=Profile()
+        trimPrimers=profile.timed('trim reads',trimPrimers)
+        findCandidatePrimers=profile.timed('candidate primers',findCandidatePrimers)
+        countDifs=profile.timed('errors in primers',countDifs)
+        isPrimerDimer=profile.timed('primer-dimers',isPrimerDimer)
+    else:
+        profile=None
+    # Arrays of primers parts for searching candidate primers for the whole batch of reads and automatons of PrimerLocator
+    # are taken from the index of primers (see makePrimerSearchIndex). If index was made for other locatorType, they are made here
+    # If candidate primers are found with PrimerLocator, arrays are not needed
+    locatorR1_5=None
+    locatorR2_5=None
+    if locatorType=='hash':
+        if 'primerR1_5_hashArrays' in primerIndex.keys():
+            primerR1_5_hashArrays=primerIndex['primerR1_5_hashArrays']
+        else:
+            primerR1_5_hashArrays=makeHashArrays(primerR1_5_hashes,primerR1_5_hashLens)
+    else:
+        primerR1_5_hashArrays=None
+        locatorR1_5=primerIndex.get('locatorR1_5')
+        locatorR2_5=primerIndex.get('locatorR2_5')
+    # Compile regular expressions for all primers
+    # Candidate primers are searched only for primers on the 5'-ends. Primers on the 3'-ends should be the same as on the 5'-end
+    matcherR1_5=PrimerMatcher(primersR1_5,errNumber,None,matcherType,locatorType=locatorType,seqLen=maxPrimerLen+primerLocBuf,
+                              name="R1 5'",profile=profile,locator=locatorR1_5)
+    if primersR2_5:
+        matcherR2_5=PrimerMatcher(primersR2_5,errNumber,None,matcherType,locatorType=locatorType,seqLen=maxPrimerLen+primerLocBuf,
+                                  name="R2 5'",profile=profile,locator=locatorR2_5)
+    if primersR1_3:
+        matcherR1_3=PrimerMatcher(primersR1_3,errNumber,minPrimer3Len,matcherType,locatorType=locatorType,name="R1 3'",profile=profile,
+                                  overlap=len(overlapPrimersR1_3)>0)
+    if primersR2_3:
+        matcherR2_3=PrimerMatcher(primersR2_3,errNumber,minPrimer3Len,matcherType,locatorType=locatorType,name="R2 3'",profile=profile,
+                                  overlap=len(overlapPrimersR2_3)>0)
+    if profile is not None and locatorType=='aho':
+        for matcher in [matcherR1_5]+([matcherR2_5] if primersR2_5 else []):
+            matcher.locator.findCandidatePrimers=profile.timed('candidate primers',matcher.locator.findCandidatePrimers)
 
 # Section of functions
-def showPercWork(done,allWork):
+def readPrimersFile(primersFile,errNumber=None):
+    # This function reads fasta-file with sequences of primers
+    # It returns list of primer sequences in brackets, list of their names and length of the longest primer
+    # If errNumber is determined, it also returns dictionary with hashes of primers parts (see makeHashes)
+    # and set of lengths of these parts. Number of parts is errNumber+1, so if primer is present in read
+    # with not more than errNumber errors, at least one of its parts is present in read without errors
+    primers=[]
+    names=[]
+    hashes={}
+    hashLens=set()
+    maxPrimerLen=0
+    for i,r in enumerate(SeqIO.parse(primersFile,'fasta')):
+        names.append(r.name)
+        primers.append('('+str(r.seq)+')')
+        if errNumber is not None:
+            partLens=math.floor(len(r.seq)/(int(errNumber)+1))
+            primerHashes,lens=makeHashes(str(r.seq),partLens)
+            hashLens.update(lens)
+            for h in primerHashes:
+                if h in hashes.keys():
+                    hashes[h].append(i)
+                else:
+                    hashes[h]=[i]
+        if len(r.seq)>maxPrimerLen:
+            maxPrimerLen=len(r.seq)
+    return(primers,names,hashes,hashLens,maxPrimerLen)
+
+def readPrimers(primersFileR1_5,primersFileR2_5,primersFileR1_3,primersFileR2_3,errNumber):
+    # This function reads all fasta-files with sequences of primers and makes index of primers
+    # Index is a dictionary with primer sequences and names for each file,
+    # hashes of parts of 5'-primers and length of the longest primer
+    primerIndex={'maxPrimerLen':0,'primerR2_5_hashes':{},'primerR2_5_hashLens':set()}
+    for primerType,primersFile in [('R1_5',primersFileR1_5),('R2_5',primersFileR2_5),('R1_3',primersFileR1_3),('R2_3',primersFileR2_3)]:
+        if not primersFile:
+            primerIndex['primers'+primerType]=None
+            primerIndex['primers'+primerType+'_names']=None
+            continue
+        try:
+            if primerType[-1]=='5':
+                primers,names,hashes,hashLens,maxPrimerLen=readPrimersFile(primersFile,errNumber)
+                primerIndex['primer'+primerType+'_hashes']=hashes
+                primerIndex['primer'+primerType+'_hashLens']=hashLens
+            else:
+                primers,names,hashes,hashLens,maxPrimerLen=readPrimersFile(primersFile)
+        except FileNotFoundError:
+            print('########')
+            print('ERROR! File not found:',primersFile)
+            print('########')
+            exit(0)
+        primerIndex['primers'+primerType]=primers
+        primerIndex['primers'+primerType+'_names']=names
+        if maxPrimerLen>primerIndex['maxPrimerLen']:
+            primerIndex['maxPrimerLen']=maxPrimerLen
+    return(primerIndex)
+
+def makePrimerSearchIndex(primerIndex,errNumber,primerLocBuf,locatorType='hash'):
+    # This function adds to the index of primers (see readPrimers) structures for searching candidate primers,
+    # so they are made once and are not made again by each process (see initializer) and in each run with cache (see savePrimerIndex)
+    # For locatorType 'hash' it adds arrays of hashes of R1 5'-primers parts (see makeHashArrays)
+    # For locatorType 'aho' it adds automatons of PrimerLocator for R1 and R2 5'-primers
+    # Regular expressions are not added, because compiled regular expressions can not be saved. They are compiled by each process
+    if locatorType=='hash':
+        primerIndex['primerR1_5_hashArrays']=makeHashArrays(primerIndex['primerR1_5_hashes'],primerIndex['primerR1_5_hashLens'])
+    else:
+        for primerType in ['R1_5','R2_5']:
+            primers=primerIndex['primers'+primerType]
+            if primers:
+                primerIndex['locator'+primerType]=PrimerLocator([primer[1:-1] for primer in primers],[int(errNumber)]*len(primers),
+                                                                primerIndex['maxPrimerLen']+primerLocBuf)
+    return(primerIndex)
+
+# Version of format of the file with cache of primers index
+primerIndexVersion='2'
+
+def makePrimerIndexKey(primersFileR1_5,primersFileR2_5,primersFileR1_3,primersFileR2_3,errNumber,primerLocBuf,minPrimer3Len,locatorType='hash'):
+    # This function makes key of primers index from content of fasta-files with primers and parameters of search
+    # Structures for searching candidate primers depend on locatorType and on presence of numpy (see makePrimerSearchIndex)
+    h=hashlib.sha256()
+    h.update(('cutPrimers primers index '+primerIndexVersion+'\t'+str(errNumber)+'\t'+str(primerLocBuf)+'\t'+str(minPrimer3Len)+
+              '\t'+locatorType+'\t'+str(np is not None)+'\n').encode('utf-8'))
+    for primersFile in [primersFileR1_5,primersFileR2_5,primersFileR1_3,primersFileR2_3]:
+        if not primersFile:
+            h.update(b'\tNone\n')
+            continue
+        with open(primersFile,'rb') as file:
+            content=file.read()
+        h.update(('\t'+str(len(content))+'\n').encode('utf-8'))
+        h.update(content)
+    return(h.hexdigest())
+
+def savePrimerIndex(primerIndexCache,primerIndexKey,primerIndex):
+    # This function saves index of primers to the cache file
+    # The first line of the file is the key of index (see makePrimerIndexKey), the rest is pickled index
+    # File is written to temporary file and then renamed, so other runs never read half-written file
+    tempFile=primerIndexCache+'.'+str(os.getpid())+'.tmp'
+    try:
+        with open(tempFile,'wb') as file:
+            file.write((primerIndexKey+'\n').encode('utf-8'))
+            pickle.dump(primerIndex,file,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tempFile,primerIndexCache)
+    except OSError:
+        print('Warning! Could not write index of primers to file:',primerIndexCache)
+
+def loadPrimerIndex(primerIndexCache,primerIndexKey):
+    # This function loads index of primers from the cache file
+    # If there is no such file or it was made for other primers or parameters, it returns None
+    try:
+        with open(primerIndexCache,'rb') as file:
+            if file.readline()!=(primerIndexKey+'\n').encode('utf-8'):
+                return(None)
+            return(pickle.load(file))
+    except (OSError,ValueError,pickle.UnpicklingError,EOFError,AttributeError,ImportError):
+        return(None)
+
+def showPercWork(done,allWork,name=''):
     percDoneWork=round((done/allWork)*100,2)
-    sys.stdout.write("\r"+str(percDoneWork)+"%")
+    sys.stdout.write("\r"+name+str(percDoneWork)+"%")
     sys.stdout.flush()
 
+def isBgzf(readsFile):
+    # This function checks if the file is compressed in BGZF format (blocked gzip, e.g. made by bgzip)
+    # BGZF-files have subfield "BC" with size of the block in the extra field of each gzip-header
+    with open(readsFile,'rb') as file:
+        header=file.read(12)
+        if len(header)<12 or header[:3]!=b'\x1f\x8b\x08' or not header[3]&4:
+            return(False)
+        extra=file.read(struct.unpack('<H',header[10:12])[0])
+    return(findBgzfBlockSize(extra) is not None)
+
+def findBgzfBlockSize(extra):
+    # This function finds size of BGZF-block in the extra field of gzip-header
+    i=0
+    while i+4<=len(extra):
+        subfieldLen=struct.unpack('<H',extra[i+2:i+4])[0]
+        if extra[i:i+2]==b'BC' and subfieldLen==2 and i+6<=len(extra):
+            return(struct.unpack('<H',extra[i+4:i+6])[0]+1)
+        i+=4+subfieldLen
+    return(None)
+
+def decompressBgzfBlocks(blocks):
+    return([zlib.decompress(block,31) for block in blocks])
+
+class BgzfReader(io.RawIOBase):
+    # This class reads BGZF-file, decompressing its blocks in several threads
+    # Blocks are read from the file without decompression and are sent to threads by groups of blocksPerTask blocks
+    # Not more than two groups per thread are kept in memory
+    # virtualOffset - if it is determined, reading begins from this virtual offset (see makeReadsIndex)
+    def __init__(self,rawFile,threads=1,blocksPerTask=64,virtualOffset=None):
+        self.rawFile=rawFile
+        self.threads=max(threads,1)
+        self.blocksPerTask=blocksPerTask
+        self.executor=ThreadPoolExecutor(self.threads)
+        # tasks - decompression of groups of blocks with positions in the file before and after each block of the group
+        # blocks - decompressed blocks of the current group with positions in the file before and after them
+        # rawPos - position in the file after the block whose data are being read now (see position)
+        self.tasks=deque()
+        self.blocks=deque()
+        self.data=b''
+        self.pos=0
+        self.rawPos=0
+        self.fileEnd=False
+        # skip - number of bytes that are skipped in the first block
+        self.skip=0
+        if virtualOffset is not None:
+            self.rawFile.seek(virtualOffset>>16)
+            self.skip=virtualOffset&0xFFFF
+        # readBlocks - last blocks whose data have been read: positions in the file before and after them,
+        # positions of their data in the decompressed stream and lengths of data (see makeVirtualOffset)
+        # Positions in the decompressed stream are counted from the beginning of reading
+        self.readBlocks=deque(maxlen=64)
+        self.dataEnd=-self.skip
+
+    def readable(self):
+        return(True)
+
+    def readBlock(self):
+        # If the file is truncated, header or block is shorter than it should be
+        header=self.rawFile.read(12)
+        if len(header)==0:
+            return(None)
+        if len(header)<12 or header[:2]!=b'\x1f\x8b':
+            raise ValueError('Wrong format of BGZF-file')
+        extraLen=struct.unpack('<H',header[10:12])[0]
+        extra=self.rawFile.read(extraLen)
+        if len(extra)<extraLen:
+            raise ValueError('Wrong format of BGZF-file')
+        blockSize=findBgzfBlockSize(extra)
+        if blockSize is None or blockSize<12+extraLen:
+            raise ValueError('Wrong format of BGZF-file')
+        body=self.rawFile.read(blockSize-12-extraLen)
+        if len(body)<blockSize-12-extraLen:
+            raise ValueError('Wrong format of BGZF-file')
+        return(header+extra+body)
+
+    def addTasks(self):
+        while not self.fileEnd and len(self.tasks)<2*self.threads:
+            blocks=[]
+            blockEnds=[]
+            while len(blocks)<self.blocksPerTask:
+                blockStart=self.rawFile.tell()
+                block=self.readBlock()
+                if block is None:
+                    self.fileEnd=True
+                    break
+                blocks.append(block)
+                blockEnds.append((blockStart,self.rawFile.tell()))
+            if len(blocks)>0:
+                self.tasks.append((self.executor.submit(decompressBgzfBlocks,blocks),blockEnds))
+
+    def readinto(self,b):
+        while self.pos>=len(self.data):
+            if len(self.blocks)==0:
+                self.addTasks()
+                if len(self.tasks)==0:
+                    return(0)
+                task,blockEnds=self.tasks.popleft()
+                self.blocks=deque(zip(task.result(),blockEnds))
+            self.data,(blockStart,self.rawPos)=self.blocks.popleft()
+            self.readBlocks.append((blockStart,self.rawPos,self.dataEnd,len(self.data)))
+            self.dataEnd+=len(self.data)
+            self.pos=self.skip
+            self.skip=0
+        n=min(len(b),len(self.data)-self.pos)
+        b[:n]=self.data[self.pos:self.pos+n]
+        self.pos+=n
+        return(n)
+
+    def position(self):
+        # Position in the file after blocks whose data have been read
+        # Blocks that are read ahead and are being decompressed are not counted
+        return(self.rawPos)
+
+    def makeVirtualOffset(self,dataPos):
+        # Convert position in the decompressed stream to virtual offset, from which reading can be continued
+        # Position should be in one of the last blocks that have been read (see readBlocks)
+        for blockStart,blockEnd,dataStart,dataLen in reversed(self.readBlocks):
+            if dataStart<=dataPos<dataStart+dataLen:
+                return((blockStart<<16)+dataPos-dataStart)
+            if dataPos==dataStart+dataLen:
+                return(blockEnd<<16)
+        if len(self.readBlocks)==0 and dataPos==0:
+            return((self.rawFile.tell()<<16)+self.skip)
+        raise ValueError('Position '+str(dataPos)+' is not in the last read blocks of BGZF-file')
+
+    def close(self):
+        self.executor.shutdown()
+        self.rawFile.close()
+        super().close()
+
+def openReadsFile(readsFile,threads=1,offset=None):
+    # This function opens FASTQ-file (plain or gzipped) for streaming reading
+    # It returns binary handle (see decodeReads), function that returns the number of (compressed) bytes consumed
+    # and function that converts number of bytes read from the handle to the offset from which reading can be continued
+    # The second one is used for showing progress, and the third one is used for saving checkpoints (see parameter -resume)
+    # Offsets are positions in not compressed files and virtual offsets in BGZF-files (see makeReadsIndex)
+    # Other gzipped files can not be read from the middle, so for them the third function is None
+    # offset - if it is determined, reading begins from this offset
+    # BGZF-files are decompressed in several threads (see BgzfReader)
+    rawFile=open(readsFile,'rb')
+    if readsFile[-3:]!='.gz':
+        if offset is not None:
+            rawFile.seek(offset)
+        start=rawFile.tell()
+        return(rawFile,rawFile.tell,lambda bytesRead:start+bytesRead)
+    elif isBgzf(readsFile):
+        reader=BgzfReader(rawFile,threads,virtualOffset=offset)
+        return(io.BufferedReader(reader),reader.position,reader.makeVirtualOffset)
+    else:
+        return(gzip.GzipFile(fileobj=rawFile),rawFile.tell,None)
+
+def decodeReads(data):
+    # This function converts bytes read from FASTQ-file to text
+    # Line endings \r\n and \r are translated to \n
+    text=data.decode()
+    if '\r' in text:
+        text=text.replace('\r\n','\n').replace('\r','\n')
+    return(text)
+
+def countReadsFromSidecar(readsFile):
+    # This function returns number of reads in the FASTQ-file if it is known from the sidecar-file:
+    # readsFile.fai (index made by "samtools fqidx", one line per read)
+    # or readsFile.count (file with one number - the number of reads)
+    # If there is no such file, it returns None
+    if os.path.exists(readsFile+'.fai'):
+        readsNum=0
+        with open(readsFile+'.fai') as file:
+            for string in file:
+                readsNum+=1
+        return(readsNum)
+    if os.path.exists(readsFile+'.count'):
+        with open(readsFile+'.count') as file:
+            try:
+                return(int(file.read().strip()))
+            except ValueError:
+                return(None)
+    return(None)
+
+def makeReadsIndex(readsFile,step):
+    # This function makes index of FASTQ-file: offsets of the first read of each chunk of step reads
+    # For not compressed files offsets are positions in the file. For BGZF-files they are virtual offsets (see Bio.bgzf):
+    # position of the beginning of BGZF-block shifted by 16 bits plus position in the decompressed block
+    # Other gzipped files can not be read from the middle, so for them it returns None
+    # It returns list of offsets and number of reads in the file
+    # If the last record of the file is not whole (e.g. file is truncated), ValueError is raised
+    linesStep=4*step
+    offsets=[]
+    linesNum=0
+    if readsFile[-3:]!='.gz':
+        with open(readsFile,'rb') as file:
+            pos=0
+            for line in file:
+                if linesNum%linesStep==0:
+                    offsets.append(pos)
+                linesNum+=1
+                pos+=len(line)
+    elif isBgzf(readsFile):
+        with open(readsFile,'rb') as rawFile:
+            reader=BgzfReader(rawFile)
+            # lineStart shows if the current block begins with a new line
+            lineStart=True
+            while True:
+                blockStart=rawFile.tell()
+                try:
+                    block=reader.readBlock()
+                except ValueError as e:
+                    reader.executor.shutdown()
+                    raise ValueError(str(e)+': '+readsFile) from None
+                if block is None:
+                    break
+                data=zlib.decompress(block,31)
+                pos=0
+                while pos<len(data):
+                    if lineStart and linesNum%linesStep==0:
+                        offsets.append((blockStart<<16)|pos)
+                    end=data.find(b'\n',pos)
+                    if end==-1:
+                        lineStart=False
+                        break
+                    linesNum+=1
+                    lineStart=True
+                    pos=end+1
+            reader.executor.shutdown()
+            # The last line may be without the end of line
+            if not lineStart:
+                linesNum+=1
+    else:
+        return(None)
+    if linesNum%4!=0:
+        raise ValueError('End of FASTQ-file without the whole record: '+readsFile)
+    readsNum=linesNum//4
+    return(offsets[:math.ceil(readsNum/step)],readsNum)
+
+def loadReadsIndex(readsFile,step):
+    # This function loads index of FASTQ-file (see makeReadsIndex) from the sidecar-file readsFile.cpi
+    # If there is no such file or it was made for other number of reads in chunk or for other file,
+    # index is made and saved to this file. The first line of sidecar-file contains number of reads in chunk,
+    # number of reads, size and time of modification of the reads file. Other lines contain offsets
+    # Sidecar-file is written to temporary file and then renamed, so other runs never read half-written file
+    stat=os.stat(readsFile)
+    key=[step,stat.st_size,stat.st_mtime_ns]
+    if os.path.exists(readsFile+'.cpi'):
+        with open(readsFile+'.cpi') as file:
+            try:
+                header=[int(x) for x in file.readline().split('\t')]
+                if len(header)==4 and [header[0]]+header[2:]==key:
+                    offsets=[int(x) for x in file]
+                    if len(offsets)!=math.ceil(header[1]/step):
+                        print('########')
+                        print('ERROR! Index file',readsFile+'.cpi','is damaged: it contains',len(offsets),'offsets instead of',
+                              str(math.ceil(header[1]/step))+'. Remove it to make index again')
+                        print('########')
+                        exit(0)
+                    return(offsets,header[1])
+            except (ValueError,IndexError):
+                pass
+    print('Making index of file',readsFile+'...')
+    offsets,readsNum=makeReadsIndex(readsFile,step)
+    tempFile=readsFile+'.cpi.'+str(os.getpid())+'.tmp'
+    try:
+        with open(tempFile,'w') as file:
+            file.write('\t'.join(map(str,[step,readsNum]+key[1:]))+'\n')
+            file.write(''.join(str(offset)+'\n' for offset in offsets))
+        os.replace(tempFile,readsFile+'.cpi')
+    except OSError:
+        print('Warning! Could not save index of file',readsFile)
+    return(offsets,readsNum)
+
+def readChunk(readsFile,offset,readsNum):
+    # This function reads text of readsNum reads from the offset of the FASTQ-file (see makeReadsIndex)
+    # Each process opens every file only once and keeps it in chunkFiles (see initializer)
+    if readsFile not in chunkFiles.keys():
+        if readsFile[-3:]=='.gz':
+            chunkFiles[readsFile]=bgzf.BgzfReader(readsFile,'rb')
+        else:
+            chunkFiles[readsFile]=open(readsFile,'rb')
+    file=chunkFiles[readsFile]
+    file.seek(offset)
+    # Line endings are translated in the same way as during streaming reading (see ReadsFileReader)
+    return(decodeReads(b''.join(islice(file,4*readsNum))))
+
+class GzipCompressor:
+    # This class compresses blocks of data as independent gzip-members in several threads
+    # Each block is added with function that writes it. Compressed blocks are written in the same order as they were added
+    # Such multi-member gzip-file is read by any gzip-reader as one file
+    # compressionLevel - level of compression (1-9)
+    # threads - number of threads for compression
+    def __init__(self,compressionLevel=9,threads=1):
+        self.compressionLevel=compressionLevel
+        self.threads=max(threads,1)
+        self.executor=ThreadPoolExecutor(self.threads)
+        # functions for writing and compressed blocks that have not been written yet
+        self.blocks=deque()
+
+    def add(self,data,write):
+        self.blocks.append((write,self.executor.submit(gzip.compress,data,self.compressionLevel,mtime=0)))
+        # Write blocks that have been already compressed
+        # and do not keep more than two blocks per thread in memory
+        while len(self.blocks)>0 and (self.blocks[0][1].done() or len(self.blocks)>2*self.threads):
+            write,block=self.blocks.popleft()
+            write(block.result())
+
+    def flush(self):
+        while len(self.blocks)>0:
+            write,block=self.blocks.popleft()
+            write(block.result())
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown()
+
+class ParallelGzipWriter:
+    # This class writes text to gzip-file using several threads
+    # Text is collected to blocks of blockSize bytes. Each block is compressed in a separate thread (see GzipCompressor)
+    # Blocks are cut at the same positions of the text, whatever parts it is written by, so the compressed file
+    # does not depend on the batch size. Only flush (see getState of Sample) compresses the last block before it is full
+    # compressionLevel - level of compression (1-9)
+    # threads - number of threads for compression
+    # append - if True, text is added to the end of existing file
+    def __init__(self,fileName,compressionLevel=9,threads=1,blockSize=1048576,append=False):
+        if append:
+            self.file=open(fileName,'ab')
+        else:
+            self.file=open(fileName,'wb')
+        self.blockSize=blockSize
+        self.compressor=GzipCompressor(compressionLevel,threads)
+        self.buffer=[]
+        self.bufferSize=0
+
+    def write(self,text):
+        if text=='':
+            return
+        data=text.encode('utf-8')
+        self.buffer.append(data)
+        self.bufferSize+=len(data)
+        if self.bufferSize>=self.blockSize:
+            self.compressBuffer()
+
+    def compressBuffer(self,lastBlock=False):
+        # Compress all full blocks of the buffer. The rest of the buffer is kept for the next block
+        # If lastBlock is True, the rest is compressed too
+        if self.bufferSize==0:
+            return
+        data=b''.join(self.buffer)
+        if lastBlock:
+            blocksEnd=len(data)
+        else:
+            blocksEnd=len(data)//self.blockSize*self.blockSize
+        for start in range(0,blocksEnd,self.blockSize):
+            self.compressor.add(data[start:min(start+self.blockSize,blocksEnd)],self.file.write)
+        self.buffer=[data[blocksEnd:]]
+        self.bufferSize=len(data)-blocksEnd
+
+    def flush(self):
+        self.compressBuffer(True)
+        self.compressor.flush()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.compressor.close()
+        self.file.close()
+
+def openOutputFile(fileName,compressionLevel=9,threads=1,offset=None):
+    # This function opens file for writing reads
+    # If name of file ends with .gz, reads are compressed with ParallelGzipWriter
+    # If offset is determined, file is truncated to this size and reads are added to its end (see parameter -resume)
+    if offset is not None:
+        os.truncate(fileName,offset)
+    if fileName[-3:]!='.gz':
+        return(open(fileName,'w' if offset is None else 'a'))
+    else:
+        return(ParallelGzipWriter(fileName,compressionLevel,threads,append=offset is not None))
+
+class AmpliconWriter:
+    # This class writes trimmed reads of each amplicon to its own file (see parameter -split)
+    # fileNames - names of files for amplicons in the order of primers
+    # Reads of each amplicon are collected to the buffer of bufferSize bytes before writing
+    # Size of all buffers is not more than maxBuffersSize bytes. If it is reached, the largest buffer is written,
+    # so memory does not grow with the number of amplicons
+    # Not more than maxOpenFiles files are open at once. If one more file is needed, the file that
+    # has not been used for the longest time is closed. When it is needed again, it is opened for appending
+    # Buffers of gzipped files are compressed as independent gzip-members in several threads (see GzipCompressor)
+    # offsets - sizes of files that have been already created, if trimming is continued (see parameter -resume)
+    def __init__(self,fileNames,compressionLevel=9,threads=1,maxOpenFiles=256,bufferSize=65536,maxBuffersSize=16777216,offsets={}):
+        self.fileNames=fileNames
+        self.maxOpenFiles=maxOpenFiles
+        self.bufferSize=bufferSize
+        self.maxBuffersSize=maxBuffersSize
+        self.compressor=GzipCompressor(compressionLevel,threads)
+        # handles - open files in the order of their use
+        self.handles=OrderedDict()
+        # created - numbers of amplicons whose files have been already created
+        self.created=set()
+        self.buffers={}
+        self.bufferSizes={}
+        self.buffersSize=0
+        for ampliconNum,fileName in enumerate(fileNames):
+            if fileName in offsets.keys():
+                os.truncate(fileName,offsets[fileName])
+                self.created.add(ampliconNum)
+
+    def getHandle(self,ampliconNum):
+        if ampliconNum in self.handles.keys():
+            self.handles.move_to_end(ampliconNum)
+            return(self.handles[ampliconNum])
+        if len(self.handles)>=self.maxOpenFiles:
+            self.handles.popitem(last=False)[1].close()
+        if ampliconNum in self.created:
+            handle=open(self.fileNames[ampliconNum],'ab')
+        else:
+            handle=open(self.fileNames[ampliconNum],'wb')
+            self.created.add(ampliconNum)
+        self.handles[ampliconNum]=handle
+        return(handle)
+
+    def write(self,ampliconNum,text):
+        if text=='':
+            return
+        if ampliconNum not in self.buffers.keys():
+            self.buffers[ampliconNum]=[]
+            self.bufferSizes[ampliconNum]=0
+        self.buffers[ampliconNum].append(text)
+        self.bufferSizes[ampliconNum]+=len(text)
+        self.buffersSize+=len(text)
+        if self.bufferSizes[ampliconNum]>=self.bufferSize:
+            self.flushBuffer(ampliconNum)
+        elif self.buffersSize>=self.maxBuffersSize:
+            self.flushBuffer(max(self.bufferSizes.keys(),key=self.bufferSizes.get))
+
+    def flushBuffer(self,ampliconNum):
+        data=''.join(self.buffers.pop(ampliconNum)).encode('utf-8')
+        self.buffersSize-=self.bufferSizes.pop(ampliconNum)
+        if self.fileNames[ampliconNum][-3:]!='.gz':
+            self.writeBlock(ampliconNum,data)
+        else:
+            self.compressor.add(data,functools.partial(self.writeBlock,ampliconNum))
+
+    def writeBlock(self,ampliconNum,data):
+        self.getHandle(ampliconNum).write(data)
+
+    def flush(self):
+        # Write all buffers to files
+        # It returns sizes of all created files
+        for ampliconNum in list(self.buffers.keys()):
+            self.flushBuffer(ampliconNum)
+        self.compressor.flush()
+        for handle in self.handles.values():
+            handle.flush()
+        return({self.fileNames[ampliconNum]:os.path.getsize(self.fileNames[ampliconNum]) for ampliconNum in self.created})
+
+    def close(self):
+        self.flush()
+        for handle in self.handles.values():
+            handle.close()
+        self.handles=OrderedDict()
+        self.compressor.close()
+
+def makeAmpliconFileNames(fileName,ampliconNames):
+    # This function makes names of files for trimmed reads of each amplicon
+    # Name of amplicon is added to the beginning of name of file, e.g. dir/AMP1_trimmed_R1.fastq.gz
+    # Separators of directories in names of amplicons are replaced with '_'
+    # If several amplicons have the same name, number of primer (from 1) is added to their names, e.g. AMP1_2_trimmed_R1.fastq.gz,
+    # so reads of different amplicons are never written to the same file
+    directory,baseName=os.path.split(fileName)
+    names=[name.replace('/','_').replace(os.sep,'_') for name in ampliconNames]
+    counts=Counter(names)
+    usedNames=set()
+    fileNames=[]
+    for i,name in enumerate(names):
+        if counts[name]>1 or name in usedNames:
+            newName=name+'_'+str(i+1)
+            while newName in usedNames:
+                newName+='_'+str(i+1)
+            name=newName
+        usedNames.add(name)
+        fileNames.append(os.path.join(directory,name+'_'+baseName))
+    return(fileNames)
+
+def parseFastq(text):
+    # This function parses text of FASTQ-file with 4 lines per record
+    # Each record is returned as a tuple of strings (header without '@',sequence,quality)
+    # Batches contain whole records, so if number of lines is not a multiple of 4, the file is truncated
+    lines=text.split('\n')
+    if lines[-1]=='':
+        lines.pop()
+    if len(lines)%4!=0:
+        raise ValueError('End of FASTQ-file without the whole record: '+lines[len(lines)//4*4])
+    for i in range(0,len(lines),4):
+        if lines[i][:1]!='@' or lines[i+2][:1]!='+':
+            raise ValueError('Wrong format of FASTQ-record: '+lines[i])
+        if len(lines[i+1])!=len(lines[i+3]):
+            raise ValueError('Lengths of sequence and quality are different in FASTQ-record: '+lines[i])
+        yield((lines[i][1:],lines[i+1],lines[i+3]))
+
+def formatFastq(record):
+    # This function makes text of FASTQ-record from a tuple (header,sequence,quality)
+    return('@'+record[0]+'\n'+record[1]+'\n+\n'+record[2]+'\n')
+
+def sliceRecord(record,start,end=None):
+    # This function cuts FASTQ-record from start to end position
+    return((record[0],record[1][start:end],record[2][start:end]))
+
 def revComplement(nuc):
     return(str(Seq(nuc).reverse_complement()))
 
@@ -82,6 +1434,18 @@ def countDifs(s1,s2):
         mism=sum(b!=c and c!='-' and b!='-' for b,c in zip(a[k][0][left:-right],a[k][1][left:-right]))
         return((mism,ins,dels,a[k][0][left:-right]))
 
+def isPrimerDimer(r1part,r2part):
+    # This function checks if pair of reads with different primers at the 5'-ends is a primer-dimer
+    # r1part and r2part - first 40 nucleotides of R1 and R2 reads
+    # The same primer-dimers are found in many read pairs, so results are kept in cache (see initializer)
+    r2part=revComplement(r2part)
+    # If R1 read is reverse complement of R2 read, there are no errors and alignment is not needed
+    if r1part==r2part:
+        return(True)
+    difs=countDifs(r1part,r2part)
+    # and len(difs[3])>=len(primersR1_5[primerNum1])
+    return(sum(difs[0:2])<=int(errNumber))
+
 def getErrors(s1,s2):
     # This function calculates number of errors between designed and sequenced primer sequences
     # s1 - initial sequence of primer
@@ -112,103 +1476,67 @@ def getErrors(s1,s2):
             muts.append(b+'/'+c)
     return(poses,muts)
 
-def trimPrimers(data):
+def trimPrimers(data,candidatePrimers=None,exactMatch=None):
     # This function get two records from both read files (R1 and R2)
-    # and trim them
+    # and trim them. Each record is a tuple (header,sequence,quality) - see parseFastq
+    # candidatePrimers - candidate primers for the 5'-end of R1 read, if they have been already found (see findCandidatePrimersBatch)
+    # exactMatch - result of searching primer without errors at the 5'-end of R1 read, if it has been already done (see PrimerMatcher.searchExact)
     # As a result it returns list
-    #[trimmedReads,untrimmedReads]
+    #[[trimmedReads,untrimmedReads],errors of primers (see countPrimersErrors),numbers of R1 and R2 primers]
+    # Numbers of primers are returned if pair was trimmed or if primers were found at the 5'-ends of both reads. Otherwise it is False
     # resList is a variable with trimmed read sequences (0) and untrimmed read sequences (1)
     resList=[[None,None],[None,None]]
     r1,r2=data
     # Find primer at the 5'-end of R1 read
-    readHashes=set()
-    for l in primerR1_5_hashLens:
-        hashes,lens=makeHashes(str(r1.seq[:maxPrimerLen+primerLocBuf]),l)
-        readHashes.update(hashes)
-    matchedPrimers={}
-    for rh in readHashes:
-        if rh in primerR1_5_hashes.keys():
-            for a in primerR1_5_hashes[rh]:
-                if a not in matchedPrimers.keys():
-                    matchedPrimers[a]=1
-                else:
-                    matchedPrimers[a]+=1
-    bestPrimer=None
-    bestPrimerValue=None
-    goodPrimers=[]
-    goodPrimerNums=[]
-    for key,item in sorted(matchedPrimers.items(),key=itemgetter(1),reverse=True):
-        if bestPrimer==None:
-            bestPrimer=key
-            bestPrimerValue=item
-            continue
-        if item>=bestPrimerValue-1:
-            goodPrimers.append(primersR1_5[key])
-            goodPrimerNums.append(key)
-        else: break
-    if bestPrimer!=None:
-        m1=regex.search(r''+primersR1_5[bestPrimer]+'{e<='+errNumber+'}',str(r1.seq[:maxPrimerLen+primerLocBuf]),flags=regex.BESTMATCH)
-    else:
-        return([[None,None],[r1,r2]],[],False)
-##    m1=regex.search(r'(?:'+'|'.join(primersR1_5)+'){e<='+errNumber+'}',str(r1.seq[:maxPrimerLen+primerLocBuf]),flags=regex.BESTMATCH)
-    # Use result of searching 5'-primer
+    # At first, primer is searched without errors. If it is not found, candidate primers are found by parts of primers
+    if exactMatch is None:
+        exactMatch=matcherR1_5.searchExact(r1[1][:maxPrimerLen+primerLocBuf])
+    m1,primerNum=exactMatch
     if m1==None:
-        if len(goodPrimers)>0:
-            m1=regex.search(r'(?:'+'|'.join(goodPrimers)+'){e<='+errNumber+'}',str(r1.seq[:maxPrimerLen+primerLocBuf]),flags=regex.BESTMATCH)
-            if m1==None:
-                # Save this pair of reads to untrimmed sequences
-                return([[None,None],[r1,r2]],[],False)
-            else:
-                primerNum=goodPrimerNums[list(m1.groups()).index(m1[0])]
+        if candidatePrimers is None and matcherR1_5.locator is not None:
+            bestPrimer,goodPrimerNums=matcherR1_5.locator.findCandidatePrimers(r1[1][:maxPrimerLen+primerLocBuf])
+        elif candidatePrimers is None:
+            bestPrimer,goodPrimerNums=findCandidatePrimers(r1[1][:maxPrimerLen+primerLocBuf],primerR1_5_hashes,primerR1_5_hashLens)
+        else:
+            bestPrimer,goodPrimerNums=candidatePrimers
+        if bestPrimer!=None:
+            m1=matcherR1_5.search(bestPrimer,r1[1][:maxPrimerLen+primerLocBuf])
         else:
             return([[None,None],[r1,r2]],[],False)
-    else:
-        primerNum=bestPrimer
+##        m1=regex.search(r'(?:'+'|'.join(primersR1_5)+'){e<='+errNumber+'}',r1[1][:maxPrimerLen+primerLocBuf],flags=regex.BESTMATCH)
+        # Use result of searching 5'-primer
+        if m1==None:
+            if len(goodPrimerNums)>0:
+                m1,primerNum=matcherR1_5.searchAny(goodPrimerNums,r1[1][:maxPrimerLen+primerLocBuf])
+                if m1==None:
+                    # Save this pair of reads to untrimmed sequences
+                    return([[None,None],[r1,r2]],[],False)
+            else:
+                return([[None,None],[r1,r2]],[],False)
+        else:
+            primerNum=bestPrimer
     # Find primer at the 5'-end of R2 read
     if primersFileR2_5:
-        m3=regex.search(r'(?:'+primersR2_5[primerNum]+'){e<='+errNumber+'}',str(r2.seq[:maxPrimerLen+primerLocBuf]),flags=regex.BESTMATCH)
+        m3=matcherR2_5.search(primerNum,r2[1][:maxPrimerLen+primerLocBuf])
         if m3==None:
             # If user wants to identify hetero- and homodimers of primers
             if idimer:
-                readHashes=set()
-                for l in primerR2_5_hashLens:
-                    hashes,lens=makeHashes(str(r2.seq[:maxPrimerLen+primerLocBuf]),l)
-                    readHashes.update(hashes)
-                matchedPrimers={}
-                for rh in readHashes:
-                    if rh in primerR2_5_hashes.keys():
-                        for a in primerR2_5_hashes[rh]:
-                            if a not in matchedPrimers.keys():
-                                matchedPrimers[a]=1
-                            else:
-                                matchedPrimers[a]+=1
-                bestPrimer=None
-                bestPrimerValue=None
-                goodPrimers=[]
-                goodPrimerNums=[]
-                for key,item in sorted(matchedPrimers.items(),key=itemgetter(1),reverse=True):
-                    if bestPrimer==None:
-                        bestPrimer=key
-                        bestPrimerValue=item
-                        continue
-                    if item>=bestPrimerValue-1:
-                        goodPrimers.append(primersR2_5[key])
-                        goodPrimerNums.append(key)
-                    else: break
+                if matcherR2_5.locator is not None:
+                    bestPrimer,goodPrimerNums=matcherR2_5.locator.findCandidatePrimers(r2[1][:maxPrimerLen+primerLocBuf])
+                else:
+                    bestPrimer,goodPrimerNums=findCandidatePrimers(r2[1][:maxPrimerLen+primerLocBuf],primerR2_5_hashes,primerR2_5_hashLens)
                 if bestPrimer!=None:
-                    m3=regex.search(r''+primersR2_5[bestPrimer]+'{e<='+errNumber+'}',str(r2.seq[:maxPrimerLen+primerLocBuf]),flags=regex.BESTMATCH)
+                    m3=matcherR2_5.search(bestPrimer,r2[1][:maxPrimerLen+primerLocBuf])
                 else:
                     return([[None,None],[r1,r2]],[],False)
-##                    m3=regex.search(r'(?:'+'|'.join(primersR2_5)+'){e<='+errNumber+'}',str(r2.seq[:maxPrimerLen+primerLocBuf]),flags=regex.BESTMATCH)
+##                    m3=regex.search(r'(?:'+'|'.join(primersR2_5)+'){e<='+errNumber+'}',r2[1][:maxPrimerLen+primerLocBuf],flags=regex.BESTMATCH)
                 # Use result of searching 5'-primer
                 if m3==None:
-                    if len(goodPrimers)>0:
-                        m3=regex.search(r'(?:'+'|'.join(goodPrimers)+'){e<='+errNumber+'}',str(r2.seq[:maxPrimerLen+primerLocBuf]),flags=regex.BESTMATCH)
+                    if len(goodPrimerNums)>0:
+                        m3,primerNum2=matcherR2_5.searchAny(goodPrimerNums,r2[1][:maxPrimerLen+primerLocBuf])
                         if m3==None:
                             # Save this pair of reads to untrimmed sequences
                             return([[None,None],[r1,r2]],[],False)
-                        else:
-                            primerNum2=goodPrimerNums[list(m3.groups()).index(m3[0])]
                     else:
                         return([[None,None],[r1,r2]],[],False)
                 else:
@@ -222,36 +1550,37 @@ def trimPrimers(data):
         else:
             primerNum2=primerNum
     # Find primer at the 3'-end of R1 read
+    # If reads overlap, primers at the 3'-ends are searched at first by primers found at the 5'-ends of other reads
     if primersFileR1_3:
-        if not minPrimer3Len:
-            m2=regex.search(r'(?:'+primersR1_3[primerNum]+'){e<='+errNumber+'}',str(r1.seq[-maxPrimerLen-primerLocBuf:]),flags=regex.BESTMATCH)
-        else:
-            errNumberDescreased=int(round(int(errNumber)*minPrimer3Len/len(primersR1_3[primerNum][:-2])))
-            m2=regex.search(r'(?:'+primersR1_3[primerNum][:minPrimer3Len]+')){e<='+str(errNumberDescreased)+'}',str(r1.seq[-maxPrimerLen-primerLocBuf:]),flags=regex.BESTMATCH)
+        m2=None
+        if primerNum in overlapPrimersR1_3:
+            m2=matcherR1_3.searchMate(primerNum,r1[1][-maxPrimerLen-primerLocBuf:],m3[0])
+        if m2==None:
+            m2=matcherR1_3.search(primerNum,r1[1][-maxPrimerLen-primerLocBuf:])
         if not primer3absent and m2==None:
             # Save this pair of reads to untrimmed sequences
             return([[None,None],[r1,r2]],[],[primerNum,primerNum2])
     # Find primer at the 3'-end of R2 read
     if primersFileR2_3:
-        if not minPrimer3Len:
-            m4=regex.search(r'(?:'+primersR2_3[primerNum]+'){e<='+errNumber+'}',str(r2.seq[-maxPrimerLen-primerLocBuf:]),flags=regex.BESTMATCH)
-        else:
-            errNumberDescreased=int(round(int(errNumber)*minPrimer3Len/len(primersR2_3[primerNum][:-2])))
-            m4=regex.search(r'(?:'+primersR2_3[primerNum][:minPrimer3Len]+')){e<='+str(errNumberDescreased)+'}',str(r2.seq[-maxPrimerLen-primerLocBuf:]),flags=regex.BESTMATCH)
+        m4=None
+        if primerNum in overlapPrimersR2_3:
+            m4=matcherR2_3.searchMate(primerNum,r2[1][-maxPrimerLen-primerLocBuf:],m1[0])
+        if m4==None:
+            m4=matcherR2_3.search(primerNum,r2[1][-maxPrimerLen-primerLocBuf:])
         if not primer3absent and m4==None:
             # Save this pair of reads to untrimmed sequences
             return([[None,None],[r1,r2]],[],[primerNum,primerNum2])
     # If all primers were found
     # Trim sequences of primers and write them to result file
     if primersFileR1_3 and m2!=None:
-        resList[0][0]=r1[m1.span()[1]:len(r1.seq)-maxPrimerLen-primerLocBuf+m2.span()[0]]
+        resList[0][0]=sliceRecord(r1,m1.span()[1],len(r1[1])-maxPrimerLen-primerLocBuf+m2.span()[0])
     else:
-        resList[0][0]=r1[m1.span()[1]:]
+        resList[0][0]=sliceRecord(r1,m1.span()[1])
     if readsFileR2:
         if primersFileR2_3 and m4!=None:
-            resList[0][1]=r2[m3.span()[1]:len(r2.seq)-maxPrimerLen-primerLocBuf+m4.span()[0]]
+            resList[0][1]=sliceRecord(r2,m3.span()[1],len(r2[1])-maxPrimerLen-primerLocBuf+m4.span()[0])
         elif primersFileR2_5:
-            resList[0][1]=r2[m3.span()[1]:]
+            resList[0][1]=sliceRecord(r2,m3.span()[1])
     # Save number of errors and primers sequences
     # [number of primer,difs1,difs2,difs3,difs4,]
     # Each dif is a set of (# of mismatches,# of insertions,# of deletions,primer_seq)
@@ -263,34 +1592,928 @@ def trimPrimers(data):
         else: difs3=(0,0,0,'')
         if primersFileR2_3 and m4!=None: difs4=countDifs(m4[0],primersR2_3[primerNum][1:-1])
         else: difs4=(0,0,0,'')
-        return (resList,[primerNum,difs1,difs2,difs3,difs4],False)
+        return (resList,[primerNum,difs1,difs2,difs3,difs4],[primerNum,primerNum])
     else:
-        return (resList,[],False)
+        return (resList,[],[primerNum,primerNum])
     
+class ReadsFileReader(threading.Thread):
+    # This class reads FASTQ-file in a separate thread by batches of batchSize reads
+    # It does not parse reads, it only takes text of 4*batchSize lines (see decodeReads)
+    # Not more than prefetch batches are kept in the queue
+    # position - function that returns number of bytes consumed from the file on the disk (see openReadsFile)
+    # If it is determined, its value after reading of each batch is saved to offset, when this batch is taken with get.
+    # It is used for showing progress, because the thread reads batches before they are processed
+    # makeOffset - function that converts number of bytes read from the handle to the offset in the file (see openReadsFile)
+    # If it is determined, offset after each batch is saved to inputOffset, when this batch is taken with get
+    # It is saved to the checkpoint, so reading can be continued from it (see Sample.getState)
+    def __init__(self,handle,batchSize,prefetch=4,position=None,makeOffset=None):
+        threading.Thread.__init__(self,daemon=True)
+        self.handle=handle
+        self.batchSize=batchSize
+        self.position=position
+        self.makeOffset=makeOffset
+        self.offset=0
+        self.inputOffset=None
+        self.batches=queue.Queue(prefetch)
+        # eof - if True, the file has ended and the thread does not put anything to the queue
+        self.eof=False
+        self.start()
+
+    def run(self):
+        try:
+            bytesRead=0
+            while True:
+                data=b''.join(islice(self.handle,4*self.batchSize))
+                bytesRead+=len(data)
+                text=decodeReads(data)
+                if self.position is not None:
+                    position=self.position()
+                else:
+                    position=0
+                if self.makeOffset is not None:
+                    self.batches.put((text,position,self.makeOffset(bytesRead)))
+                else:
+                    self.batches.put((text,position,None))
+                if text=='':
+                    break
+        except (EOFError,zlib.error,gzip.BadGzipFile) as e:
+            # Truncated or damaged gzipped file. ValueError is shown by the main process as other errors of input files
+            self.batches.put(ValueError('Wrong format of gzipped file ('+str(e)+')'))
+        except Exception as e:
+            self.batches.put(e)
+
+    def get(self):
+        # It returns text of the next batch or empty string if the file has ended
+        # After the end of the file it always returns empty string
+        if self.eof:
+            return('')
+        item=self.batches.get()
+        if isinstance(item,Exception):
+            raise item
+        text,self.offset,self.inputOffset=item
+        if text=='':
+            self.eof=True
+        return(text)
+
+def readBatches(readerR1,readerR2,sampleNum=0,inFlight=None,firstBatchNum=0):
+    # This function reads batches of reads from R1 and R2 files (see ReadsFileReader)
+    # As a result it yields list [number of sample,number of batch,text of R1 reads,text of R2 reads]
+    # For single-end reads text of R2 reads is empty
+    # If reads are read by chunks (see Sample.readChunks), texts are replaced by [file,offset,number of reads]
+    # inFlight - semaphore that limits number of batches that have been read but whose results have not been written yet
+    # firstBatchNum - number of the first batch. It is not 0, if trimming is continued (see parameter -resume)
+    batchNum=firstBatchNum
+    while True:
+        if inFlight:
+            inFlight.acquire()
+        if profile is not None:
+            start=time.perf_counter()
+        textR1=readerR1.get()
+        if readerR2:
+            textR2=readerR2.get()
+        else:
+            textR2=''
+        # If one of files has ended before other one, numbers of reads in them are different
+        # Exception is raised, so it is passed from the thread that reads batches to the main process (see Pool)
+        if readerR2 and countLines(textR1)!=countLines(textR2):
+            raise ValueError('Numbers of reads in R1 and R2 files are different')
+        if textR1=='':
+            if inFlight:
+                inFlight.release()
+            break
+        if profile is not None:
+            profile.addTime('read input (main process)',time.perf_counter()-start)
+        yield([sampleNum,batchNum,textR1,textR2])
+        batchNum+=1
+
+def countLines(text):
+    # This function returns number of lines in the text. The last line may be without the end of line
+    return(text.count('\n')+(text!='' and text[-1]!='\n'))
+
+def trimBatch(batch):
+    # This function gets one batch of reads (see readBatches), parses and trims them
+    # As a result it returns list
+    # [number of sample,number of batch,number of reads,
+    #  text of trimmed R1 reads,text of trimmed R2 reads,text of untrimmed R1 reads,text of untrimmed R2 reads,
+    #  statistics of errors in primers (see countPrimersErrors) or None,
+    #  statistics of primer-dimers,
+    #  timers and counters of the batch (see Profile) or None,
+    #  numbers of hits and misses of caches of alignments during the batch,
+    #  numbers of trimmed and untrimmed reads of each amplicon]
+    # Statistics of primer-dimers is a dictionary with pairs of numbers of R1 and R2 primers as keys
+    # and lists [number of primer-dimers,number of checked read pairs] as values
+    # If untrimmed reads are written to the same file as trimmed reads, they are added to the text of trimmed reads,
+    # so reads in each output file keep their order from input file
+    # If trimmed reads of each amplicon are written to separate files, texts of trimmed reads are dictionaries
+    # with numbers of primers as keys
+    # Numbers of reads of amplicons is a dictionary with numbers of primers as keys and lists [trimmed,untrimmed] as values
+    # Untrimmed reads are counted only if the same primers were found at the 5'-ends of both reads
+    sampleNum,batchNum,textR1,textR2=batch
+    if profile is not None:
+        batchStart=time.perf_counter()
+    # If reads are read by chunks, process reads them from the files itself
+    if isinstance(textR1,list):
+        textR1=readChunk(*textR1)
+        if textR2:
+            textR2=readChunk(*textR2)
+        if profile is not None:
+            profile.addTime('read input chunks',time.perf_counter()-batchStart)
+    trimmedR1=[]; trimmedR2=[]
+    if untrimmedToTrimmed[0]:
+        untrimmedR1=trimmedR1
+    else:
+        untrimmedR1=[]
+    if untrimmedToTrimmed[1]:
+        untrimmedR2=trimmedR2
+    else:
+        untrimmedR2=[]
+    ampliconsR1={}; ampliconsR2={}
+    ampliconsNums={}
+    primerErrors=[]
+    dimers={}
+    readsNum=0
+    # pathsNums - numbers of trimmed reads, untrimmed reads, possible primer-dimers and primer-dimers
+    pathsNums=[0,0,0,0]
+    if profile is not None:
+        start=time.perf_counter()
+    data1=list(parseFastq(textR1))
+    if readsFileR2:
+        data2=list(parseFastq(textR2))
+    else:
+        data2=repeat('')
+    if profile is not None:
+        profile.addTime('parse reads',time.perf_counter()-start)
+    # At first, primers at the 5'-end of R1 reads are searched without errors
+    exactMatches=[matcherR1_5.searchExact(r1[1][:maxPrimerLen+primerLocBuf]) for r1 in data1]
+    # If numpy is installed, candidate primers for all other R1 reads are found at once
+    if primerR1_5_hashArrays is not None:
+        if profile is not None:
+            start=time.perf_counter()
+        batchCandidates=iter(findCandidatePrimersBatch([r1[1] for r1,exactMatch in zip(data1,exactMatches) if exactMatch[0] is None],
+                                                       primerR1_5_hashArrays,maxPrimerLen+primerLocBuf))
+        candidatePrimers=[next(batchCandidates) if exactMatch[0] is None else None for exactMatch in exactMatches]
+        if profile is not None:
+            profile.addTime('candidate primers',time.perf_counter()-start)
+    else:
+        candidatePrimers=repeat(None)
+    for data,candidates,exactMatch in zip(zip(data1,data2),candidatePrimers,exactMatches):
+        readsNum+=1
+        res=trimPrimers(data,candidates,exactMatch)
+        if res[1]!=[]:
+            primerErrors.append(res[1])
+        if readsFileR2:
+            if res[0][0][0] is not None and res[0][0][1] is not None:
+                if splitAmplicons:
+                    ampliconsR1.setdefault(res[2][0],[]).append(formatFastq(res[0][0][0]))
+                    ampliconsR2.setdefault(res[2][0],[]).append(formatFastq(res[0][0][1]))
+                else:
+                    trimmedR1.append(formatFastq(res[0][0][0]))
+                    trimmedR2.append(formatFastq(res[0][0][1]))
+                ampliconsNums.setdefault(res[2][0],[0,0])[0]+=1
+                pathsNums[0]+=1
+                continue
+            # If user want to identify primer-dimers, check if this pair is a primer-dimer
+            if idimer and res[2]:
+                pathsNums[2]+=1
+                counts=dimers.setdefault((res[2][0],res[2][1]),[0,0])
+                counts[1]+=1
+                if isPrimerDimer(res[0][1][0][1][:40],res[0][1][1][1][:40]):
+                    counts[0]+=1
+                    pathsNums[3]+=1
+                    continue
+            untrimmedR1.append(formatFastq(res[0][1][0]))
+            untrimmedR2.append(formatFastq(res[0][1][1]))
+            if res[2] and res[2][0]==res[2][1]:
+                ampliconsNums.setdefault(res[2][0],[0,0])[1]+=1
+            pathsNums[1]+=1
+        else:
+            if res[0][0][0] is not None:
+                if splitAmplicons:
+                    ampliconsR1.setdefault(res[2][0],[]).append(formatFastq(res[0][0][0]))
+                else:
+                    trimmedR1.append(formatFastq(res[0][0][0]))
+                ampliconsNums.setdefault(res[2][0],[0,0])[0]+=1
+                pathsNums[0]+=1
+            else:
+                untrimmedR1.append(formatFastq(res[0][1][0]))
+                pathsNums[1]+=1
+    if untrimmedToTrimmed[0]:
+        untrimmedR1=[]
+    if untrimmedToTrimmed[1]:
+        untrimmedR2=[]
+    res=[sampleNum,batchNum,readsNum,''.join(trimmedR1),''.join(trimmedR2),''.join(untrimmedR1),''.join(untrimmedR2),
+         None,dimers,None,[0,0],ampliconsNums]
+    if splitAmplicons:
+        res[3]={primerNum:''.join(texts) for primerNum,texts in ampliconsR1.items()}
+        res[4]={primerNum:''.join(texts) for primerNum,texts in ampliconsR2.items()}
+    if primersStatistics:
+        if profile is not None:
+            start=time.perf_counter()
+        res[7]=countPrimersErrors(primerErrors)
+        if profile is not None:
+            profile.addTime('statistics of errors',time.perf_counter()-start)
+    if alignmentCaches:
+        hits=sum(cache.cache_info().hits for cache in alignmentCaches)
+        misses=sum(cache.cache_info().misses for cache in alignmentCaches)
+        res[10]=[hits-alignmentCacheCounts[0],misses-alignmentCacheCounts[1]]
+        alignmentCacheCounts[0]=hits
+        alignmentCacheCounts[1]=misses
+    if profile is not None:
+        profile.count('alignment cache hits',res[10][0])
+        profile.count('alignment cache misses',res[10][1])
+        profile.count('reads',readsNum)
+        profile.count('reads trimmed',pathsNums[0])
+        profile.count('reads untrimmed',pathsNums[1])
+        profile.count('reads possible primer-dimers',pathsNums[2])
+        profile.count('reads primer-dimers',pathsNums[3])
+        profile.count('bytes of reads to processes',len(textR1)+len(textR2))
+        profile.count('bytes of reads from processes',sum(len(text) for text in res[5:7])+
+                      sum(len(text) for texts in res[3:5] for text in (texts.values() if splitAmplicons else [texts])))
+        profile.addTime('whole batch in process',time.perf_counter()-batchStart)
+        res[9]=profile.take()
+    return(res)
+
+def checkSynthesisError(seq1,seq2,primer):
+    # This function checks if error in primer of overlapping paired-end reads is a synthesis error
+    # seq1 - sequence of primer found at the 3'-end of one read, seq2 - the same primer found at the 5'-end of other read
+    # primer - designed sequence of primer
+    # Many read pairs have the same sequences of primers, so results are kept in cache (see initializer)
+    # It returns True if it is synthesis error, and positions and types of errors (see getErrors)
+    # Rererse complement one of primer sequences
+    rev=str(Seq(seq1).reverse_complement())
+    a=pairwise2.align.globalms(rev,seq2,2,-1,-1.53,-0.1)
+    # If found sequences are identical, it's a synthesis error
+    if list(a[0][0])==list(a[0][1]):
+        # Now we want to save information about error's location
+        poses,muts=getErrors(primer,seq2)
+        return(True,poses,muts)
+    return(False,[],[])
+
+def classifyPrimersErrors(item):
+    # This function finds types of errors in primers of one read pair
+    # item - [number of primer,difs1,difs2,difs3,difs4] (see trimPrimers)
+    # It returns list of values of statistics (see countPrimersErrors) that should be increased
+    # as pairs (0 for F-primer or 1 for R-primer, number of value), list of positions of errors and list of types of errors
+    changes=[(0,0),(1,0)]
+    poses=[]
+    muts=[]
+            
+##          R                           F_reverse_complement
+## R1 5'---------________________________---------3'
+## R2 5'---------________________________---------3'
+##          F                           R_reverse_complement
+            
+    # F-primers of pairs
+    # The last variant is a case when we have single-end reads and 3' does not contain primer sequence
+    # (primers for the 5'-end of R1 reads are always present)
+    if ((not primersFileR1_3 and primersFileR2_5 and item[3][0:3]==(0,0,0)) or
+        (primersFileR1_3 and primersFileR2_5 and item[3][0:3]==(0,0,0) and item[2][0:3]==(0,0,0)) or
+        (not primersFileR2_5 and not primersFileR1_3 and not primersFileR2_3)):
+        changes.append((0,1))
+    # If it was overlapping paired-end reads, we try to check if this is sequencing error
+    elif primersFileR1_3 and primersFileR2_5 and primersFileR2_3 and item[2][3]!='' and item[3][3]!='':
+        synthesisError,p,m=checkSynthesisError(item[2][3],item[3][3],primersR2_5[item[0]][1:-1])
+        if synthesisError:
+            changes.append((0,3))
+            poses.extend(p)
+            muts.extend(m)
+        # Else it's a sequencing error
+        else:
+            changes.append((0,2))
+    # Else we just save it as sequencing error
+    else:
+        changes.append((0,2))
+    # R-primers of pairs
+    # For R-primer we always have sequence at least at 5' end of R1
+    if ((not primersFileR2_3 and item[1][0:3]==(0,0,0)) or
+        (primersFileR2_3 and item[1][0:3]==(0,0,0) and item[4][0:3]==(0,0,0))):
+        changes.append((1,1))
+    # If it was overlapping paired-end reads, we try to check if this is sequencing error
+    elif primersFileR1_3 and primersFileR2_5 and primersFileR2_3 and item[4][3]!='' and item[1][3]!='':
+        try:
+            synthesisError,p,m=checkSynthesisError(item[4][3],item[1][3],primersR1_5[item[0]][1:-1])
+        except IndexError:
+            # It is raised in a worker, so exit() would hang the pool. Main process reports it
+            raise ValueError('Could not classify errors of primers: '+str(item)) from None
+        if synthesisError:
+            changes.append((1,3))
+            poses.extend(p)
+            muts.extend(m)
+        # Else it's a sequencing error
+        else:
+            changes.append((1,2))
+    # Else we just save it as sequencing error
+    else:
+        changes.append((0,2))
+    return(changes,poses,muts)
+
+def countPrimersErrors(primerErrorQ,primersErrors=None,primersErrorsPos=None,primersErrorsType=None):
+    # This function counts statistics of errors in primers from results of trimPrimers
+    # If dictionaries with statistics are given, values are added to them
+    # It returns three dictionaries:
+    # primersErrors - errors in primers
+    # primersErrorsPos - statistics about location of errors
+    # primersErrorsType - statistics about type of error
+    if primersErrors is None:
+        primersErrors={}
+        primersErrorsPos={}
+        primersErrorsType={}
+    for item in primerErrorQ:
+        # If key for this primer has not been created, yet
+        if not item[0] in primersErrors.keys():
+            # For each primer of each pair we will gather the following values:
+            # [(0)number of read pairs,
+            # (1)number of primers without errors,
+            # (2)number of primers with sequencing errors,
+            # (3)number of primers with synthesis errors
+            # The first item of list - F
+            # The second - R
+            primersErrors[item[0]]=[[0,0,0,0],[0,0,0,0]]
+        changes,poses,muts=classifyPrimersErrors(item)
+        for primer,valueNum in changes:
+            primersErrors[item[0]][primer][valueNum]+=1
+        for p in poses:
+            if p not in primersErrorsPos.keys():
+                primersErrorsPos[p]=1
+            else:
+                primersErrorsPos[p]+=1
+        for m in muts:
+            if m not in primersErrorsType.keys():
+                primersErrorsType[m]=1
+            else:
+                primersErrorsType[m]+=1
+    return(primersErrors,primersErrorsPos,primersErrorsType)
+
+def mergePrimersErrors(primersErrors,primersErrorsPos,primersErrorsType,primersErrors2,primersErrorsPos2,primersErrorsType2):
+    # This function adds statistics of errors in primers (see countPrimersErrors) of one part of reads to others
+    for key,item in primersErrors2.items():
+        if key not in primersErrors.keys():
+            primersErrors[key]=[[0,0,0,0],[0,0,0,0]]
+        for i in range(2):
+            for j in range(4):
+                primersErrors[key][i][j]+=item[i][j]
+    for stats,stats2 in [(primersErrorsPos,primersErrorsPos2),(primersErrorsType,primersErrorsType2)]:
+        for key,value in stats2.items():
+            stats[key]=stats.get(key,0)+value
+
+def writePrimersStatistics(primersStatisticsFile,primersErrors,primersErrorsPos,primersErrorsType):
+    # This function writes statistics of errors in primers (see countPrimersErrors) to three files:
+    # primersStatisticsFile, and files with the same name ending with _poses.tab and _types.tab
+    primersStatistics=open(primersStatisticsFile,'w')
+    primersStatistics.write('Primer\tTotal_number_of_reads\tNumber_without_any_errors\t'
+                            'Number_with_sequencing_errors\tNumber_with_synthesis_errors\n')
+    for key,item in primersErrors.items():
+        primersStatistics.write(str(key+1)+'F\t'+'\t'.join(map(str,item[0]))+'\n')
+        primersStatistics.write(str(key+1)+'R\t'+'\t'.join(map(str,item[1]))+'\n')
+    primersStatistics.close()
+
+    primersStatisticsPos=open(primersStatisticsFile[:-4]+'_poses.tab','w')
+    primersStatisticsPos.write('Position_in_primer\tNumber_of_mutations\n')
+    for key,item in primersErrorsPos.items():
+        primersStatisticsPos.write(str(key)+'\t'+str(item)+'\n')
+    primersStatisticsPos.close()
+
+    primersStatisticsType=open(primersStatisticsFile[:-4]+'_types.tab','w')
+    primersStatisticsType.write('Error_type\tNumber_of_mutations\n')
+    for key,item in primersErrorsType.items():
+        primersStatisticsType.write(str(key)+'\t'+str(item)+'\n')
+    primersStatisticsType.close()
+
+def writePrimerDimers(idimerFile,primerDimers):
+    # This function writes statistics of primer-dimers to the file
+    # primerDimers - dictionary with names of two primers as keys
+    # and lists [number of primer-dimers,number of checked read pairs] as values
+    # Only pairs of primers that formed primer-dimers are written, without numbers of checked read pairs,
+    # so the format of the file is the same as before. Numbers of checked read pairs are written with -metrics
+    file=open(idimerFile,'w')
+    file.write('Primer-dimer\tNumber of read pairs\n')
+    for key,item in sorted(primerDimers.items(),key=lambda x:x[1][0],reverse=True):
+        if item[0]>0:
+            file.write(key+'\t'+str(item[0])+'\n')
+    file.close()
+
+def checkOutputFile(fileName):
+    # This function checks if the file can be created
+    directory=os.path.dirname(os.path.abspath(fileName))
+    if not os.path.isdir(directory) or not os.access(directory,os.W_OK):
+        print('########')
+        print('ERROR! Could not create file:',fileName)
+        print('########')
+        exit(0)
+
+class Sample:
+    # This class keeps input and output files and statistics of one sample
+    # Files are opened when trimming of the sample begins (openFiles) and are closed when all its reads are written (close)
+    def __init__(self,name,readsFileR1,readsFileR2,trimmedReadsR1,trimmedReadsR2,untrimmedReadsR1,untrimmedReadsR2,primersStatistics,idimer,ordered=False):
+        # ordered - if True, results of batches are written in the same order as reads in the input files
+        self.name=name
+        self.readsFileR1=readsFileR1
+        self.readsFileR2=readsFileR2
+        self.trimmedReadsR1=trimmedReadsR1
+        self.trimmedReadsR2=trimmedReadsR2
+        self.untrimmedReadsR1=untrimmedReadsR1
+        self.untrimmedReadsR2=untrimmedReadsR2
+        self.primersStatistics=primersStatistics
+        self.idimer=idimer
+        # batchesNum - number of batches of the sample. It is known only after all reads of the sample have been read
+        self.batchesNum=None
+        self.batchesDone=0
+        self.ordered=ordered
+        # pendingResults - results of batches that are waiting for previous batches to be written
+        self.pendingResults={}
+        self.doneWork=0
+        # Statistics of errors in primers (see countPrimersErrors)
+        self.primersErrors={}
+        self.primersErrorsPos={}
+        self.primersErrorsType={}
+        self.primerDimers={}
+        # Numbers of trimmed reads and of trimmed and untrimmed reads of each amplicon (see trimBatch)
+        self.trimmedNum=0
+        self.ampliconsNums={}
+        # outputFiles - opened output files with their names as keys
+        # resumeOffsets - sizes of output files from the checkpoint, if trimming is continued (see restoreState)
+        self.outputFiles={}
+        self.resumeOffsets={}
+        # ampliconsR1 and ampliconsR2 - files for trimmed reads of each amplicon (see AmpliconWriter) or None
+        self.ampliconsR1=None
+        self.ampliconsR2=None
+        # chunks - offsets of chunks of reads in R1 and R2 files and numbers of reads in them (see loadChunks)
+        self.chunks=None
+        # batchOffsets - positions in the R1-file after reading of batches whose results have not been written yet
+        # and offsets in R1 and R2 files after them (see ReadsFileReader)
+        # readOffset - the largest such position of written batches. Progress is shown by it (see showProgress)
+        # inputOffsets - offsets in R1 and R2 files after the last written batch. If trimming is continued,
+        # reading begins from them (see openFiles). For gzipped files that are not BGZF they are None
+        self.batchOffsets={}
+        self.readOffset=0
+        self.inputOffsets=(None,None)
+        self.files=[]
+        self.closed=False
+        # lock - files are opened in the thread that reads batches for the pool of processes (see readAllBatches),
+        # and their state is saved in the main thread (see getState), so they are not used by both threads at once
+        self.lock=threading.Lock()
+
+    def checkFiles(self):
+        # Check that input files exist and output files can be created
+        for readsFile in [self.readsFileR1,self.readsFileR2]:
+            if readsFile and not os.path.isfile(readsFile):
+                print('########')
+                print('ERROR! Could not open file:',readsFile)
+                print('########')
+                exit(0)
+        for outputFile in [self.trimmedReadsR1,self.trimmedReadsR2,self.untrimmedReadsR1,self.untrimmedReadsR2,self.primersStatistics,self.idimer]:
+            if outputFile:
+                checkOutputFile(outputFile)
+
+    def loadChunks(self,batchSize,part=(1,1)):
+        # Load indexes of input files (see loadReadsIndex) and select chunks of the part of reads
+        # part - number of part and number of parts to which reads are divided
+        indexR1,readsNum=loadReadsIndex(self.readsFileR1,batchSize)
+        if self.readsFileR2:
+            indexR2,readsNumR2=loadReadsIndex(self.readsFileR2,batchSize)
+            # Numbers of reads are compared before trimming (see main part). Here files are opened in the thread
+            # that reads batches for the pool of processes, so exception is raised to pass it to the main process
+            if readsNumR2!=readsNum:
+                raise ValueError('Numbers of reads in R1 and R2 files are different: '+self.readsFileR1+' '+self.readsFileR2)
+        else:
+            indexR2=repeat(None)
+        self.chunks=[]
+        for i,(offsetR1,offsetR2) in enumerate(zip(indexR1,indexR2)):
+            self.chunks.append((offsetR1,offsetR2,min(batchSize,readsNum-i*batchSize)))
+        self.chunks=self.chunks[len(self.chunks)*(part[0]-1)//part[1]:len(self.chunks)*part[0]//part[1]]
+        self.allWork=max(sum(chunk[2] for chunk in self.chunks),1)
+        # If trimming is continued, chunks that have been already written are skipped
+        self.chunks=self.chunks[self.batchesDone:]
+
+    def openOutputFile(self,fileName,compressionLevel,threads):
+        # Open output file (see openOutputFile) or return it, if it has been already opened
+        if fileName not in self.outputFiles.keys():
+            self.outputFiles[fileName]=openOutputFile(fileName,compressionLevel,threads,self.resumeOffsets.get(fileName))
+            self.files.append(self.outputFiles[fileName])
+        return(self.outputFiles[fileName])
+
+    def openFiles(self,compressionLevel,threads,batchSize,chunks=False,part=(1,1),ampliconNames=None,maxOpenFiles=256):
+        # Open output files and start reading input files
+        # Reads are not loaded to the memory. They are streamed from the files in separate threads (see ReadsFileReader)
+        # If number of reads is known from sidecar-file, progress is shown by the number of processed reads
+        # Else it is shown by the position in the R1-file after the last batch whose result has been written
+        # chunks - if True, input files are not read here. Processes read chunks of reads themselves (see readChunks)
+        # ampliconNames - if it is determined, trimmed reads of each amplicon are written to separate files (see AmpliconWriter)
+        # and files of trimmed reads are used only for untrimmed reads, if they have the same names
+        # If trimming is continued (see restoreState), output files are truncated to their sizes from the checkpoint
+        # and reading of input files begins from their offsets after the last written batch
+        # Gzipped files that are not BGZF can not be read from the middle, so reads that have been already written are skipped in them
+        if ampliconNames is not None:
+            self.ampliconsR1=AmpliconWriter(makeAmpliconFileNames(self.trimmedReadsR1,ampliconNames),compressionLevel,threads,maxOpenFiles,
+                                            offsets=self.resumeOffsets)
+            self.files.append(self.ampliconsR1)
+        else:
+            self.trimmedR1=self.openOutputFile(self.trimmedReadsR1,compressionLevel,threads)
+        self.untrimmedR1=self.openOutputFile(self.untrimmedReadsR1,compressionLevel,threads)
+        if self.readsFileR2:
+            if ampliconNames is not None:
+                self.ampliconsR2=AmpliconWriter(makeAmpliconFileNames(self.trimmedReadsR2,ampliconNames),compressionLevel,threads,maxOpenFiles,
+                                                offsets=self.resumeOffsets)
+                self.files.append(self.ampliconsR2)
+            else:
+                self.trimmedR2=self.openOutputFile(self.trimmedReadsR2,compressionLevel,threads)
+            self.untrimmedR2=self.openOutputFile(self.untrimmedReadsR2,compressionLevel,threads)
+        if chunks:
+            self.loadChunks(batchSize,part)
+            return
+        self.allWork=countReadsFromSidecar(self.readsFileR1)
+        self.readsFileR1Size=max(os.path.getsize(self.readsFileR1),1)
+        self.handleR1,positionR1,makeOffsetR1=openReadsFile(self.readsFileR1,threads,self.inputOffsets[0])
+        self.files.append(self.handleR1)
+        if self.inputOffsets[0] is None:
+            deque(islice(self.handleR1,4*self.doneWork),maxlen=0)
+        self.readerR1=ReadsFileReader(self.handleR1,batchSize,position=positionR1,makeOffset=makeOffsetR1)
+        if self.readsFileR2:
+            self.handleR2,positionR2,makeOffsetR2=openReadsFile(self.readsFileR2,threads,self.inputOffsets[1])
+            self.files.append(self.handleR2)
+            if self.inputOffsets[1] is None:
+                deque(islice(self.handleR2,4*self.doneWork),maxlen=0)
+            self.readerR2=ReadsFileReader(self.handleR2,batchSize,makeOffset=makeOffsetR2)
+        else:
+            self.readerR2=None
+
+    def readChunks(self,sampleNum,inFlight=None):
+        # Make batches of the sample from chunks of reads (see loadChunks)
+        # Instead of texts of reads, each batch contains files and offsets from which processes read reads (see readChunk)
+        for batchNum,(offsetR1,offsetR2,readsNum) in enumerate(self.chunks,self.batchesDone):
+            if inFlight:
+                inFlight.acquire()
+            if self.readsFileR2:
+                yield([sampleNum,batchNum,[self.readsFileR1,offsetR1,readsNum],[self.readsFileR2,offsetR2,readsNum]])
+            else:
+                yield([sampleNum,batchNum,[self.readsFileR1,offsetR1,readsNum],''])
+
+    def readBatches(self,sampleNum,inFlight=None):
+        # Read batches of the sample (see readBatches) and count them
+        # If trimming is continued, batches that have been already written are counted too
+        batchesNum=self.batchesDone
+        # Errors of reading are raised with names of files of the sample
+        if self.chunks is not None:
+            batches=self.readChunks(sampleNum,inFlight)
+        else:
+            batches=readBatches(self.readerR1,self.readerR2,sampleNum,inFlight,self.batchesDone)
+        try:
+            for batch in batches:
+                batchesNum+=1
+                if self.chunks is None:
+                    self.batchOffsets[batch[1]]=(self.readerR1.offset,self.readerR1.inputOffset,
+                                                 self.readerR2.inputOffset if self.readerR2 else None)
+                yield(batch)
+        except ValueError as e:
+            raise ValueError(str(e)+': '+' '.join(readsFile for readsFile in [self.readsFileR1,self.readsFileR2] if readsFile)) from None
+        self.batchesNum=batchesNum
+
+    def allBatchesRead(self):
+        return(self.batchesNum is not None)
+
+    def showProgress(self):
+        if self.name:
+            name=self.name+': '
+        else:
+            name=''
+        if self.allWork:
+            showPercWork(self.doneWork,self.allWork,name)
+        else:
+            showPercWork(self.readOffset,self.readsFileR1Size,name)
+
+    def writeResult(self,res):
+        # Receive result of trimBatch and write it to the files of the sample
+        # If output should be ordered, results are kept until all previous batches are written
+        # It returns number of batches that have been written
+        if not self.ordered:
+            self.writeBatch(res)
+            return(1)
+        self.pendingResults[res[1]]=res
+        batchesWritten=0
+        while self.batchesDone in self.pendingResults.keys():
+            self.writeBatch(self.pendingResults.pop(self.batchesDone))
+            batchesWritten+=1
+        return(batchesWritten)
+
+    def writeBatch(self,res):
+        # Write result of trimBatch to the files of the sample
+        self.batchesDone+=1
+        self.doneWork+=res[2]
+        if res[1] in self.batchOffsets.keys():
+            readOffset,inputOffsetR1,inputOffsetR2=self.batchOffsets.pop(res[1])
+            self.inputOffsets=(inputOffsetR1,inputOffsetR2)
+            self.readOffset=max(self.readOffset,readOffset)
+        self.showProgress()
+        if res[7] is not None:
+            mergePrimersErrors(self.primersErrors,self.primersErrorsPos,self.primersErrorsType,*res[7])
+        for ampliconNum,nums in res[11].items():
+            if ampliconNum not in self.ampliconsNums.keys():
+                self.ampliconsNums[ampliconNum]=[0,0]
+            self.ampliconsNums[ampliconNum][0]+=nums[0]
+            self.ampliconsNums[ampliconNum][1]+=nums[1]
+            self.trimmedNum+=nums[0]
+        # outputs - functions for writing to files and texts for them
+        # Trimmed reads of each amplicon are written to its own files (see AmpliconWriter)
+        if self.ampliconsR1 is not None:
+            outputs=[(functools.partial(self.ampliconsR1.write,ampliconNum),text) for ampliconNum,text in res[3].items()]
+            if self.readsFileR2:
+                outputs.extend((functools.partial(self.ampliconsR2.write,ampliconNum),text) for ampliconNum,text in res[4].items())
+        else:
+            outputs=[(self.trimmedR1.write,res[3])]
+            if self.readsFileR2:
+                outputs.append((self.trimmedR2.write,res[4]))
+        outputs.append((self.untrimmedR1.write,res[5]))
+        if self.readsFileR2:
+            outputs.append((self.untrimmedR2.write,res[6]))
+        # Primer-dimers are identified by processes (see trimBatch), so only their numbers are added
+        for (primerNum1,primerNum2),counts in res[8].items():
+            key=primersR1_5_names[primerNum1]+' & '+primersR2_5_names[primerNum2]
+            if key not in self.primerDimers.keys():
+                self.primerDimers[key]=[0,0]
+            self.primerDimers[key][0]+=counts[0]
+            self.primerDimers[key][1]+=counts[1]
+        if profile is not None:
+            start=time.perf_counter()
+            profile.count('bytes written',sum(len(text) for write,text in outputs))
+        for write,text in outputs:
+            write(text)
+        # Time of writing includes time of waiting for compression of output
+        if profile is not None:
+            profile.addTime('write output (main process)',time.perf_counter()-start)
+
+    def getState(self):
+        # Return state of the sample for the checkpoint (see Checkpoint)
+        # Output files are flushed, so their sizes correspond to the batches that have been written
+        offsets={}
+        with self.lock:
+            if not self.closed:
+                for fileName,file in self.outputFiles.items():
+                    file.flush()
+                    offsets[fileName]=os.path.getsize(fileName)
+                for ampliconWriter in [self.ampliconsR1,self.ampliconsR2]:
+                    if ampliconWriter is not None:
+                        offsets.update(ampliconWriter.flush())
+        return({'name':self.name,'readsFileR1':self.readsFileR1,'readsFileR2':self.readsFileR2,'closed':self.closed,
+                'batchesDone':self.batchesDone,'doneWork':self.doneWork,'offsets':offsets,'inputOffsets':self.inputOffsets,
+                'primersErrors':self.primersErrors,'primersErrorsPos':self.primersErrorsPos,'primersErrorsType':self.primersErrorsType,
+                'primerDimers':self.primerDimers,'trimmedNum':self.trimmedNum,'ampliconsNums':self.ampliconsNums})
+
+    def restoreState(self,state):
+        # Continue trimming of the sample from the state saved in the checkpoint (see getState)
+        # If sample had been already trimmed, it is not trimmed again
+        self.closed=state['closed']
+        self.batchesDone=state['batchesDone']
+        self.doneWork=state['doneWork']
+        self.resumeOffsets=state['offsets']
+        self.inputOffsets=state['inputOffsets']
+        self.primersErrors=state['primersErrors']
+        self.primersErrorsPos=state['primersErrorsPos']
+        self.primersErrorsType=state['primersErrorsType']
+        self.primerDimers=state['primerDimers']
+        self.trimmedNum=state['trimmedNum']
+        self.ampliconsNums=state['ampliconsNums']
+        if self.closed:
+            self.batchesNum=self.batchesDone
+
+    def close(self):
+        # Write statistics of the sample and close its files
+        if self.primersStatistics:
+            writePrimersStatistics(self.primersStatistics,self.primersErrors,self.primersErrorsPos,self.primersErrorsType)
+        if self.idimer:
+            writePrimerDimers(self.idimer,self.primerDimers)
+        for file in self.files:
+            file.close()
+        self.closed=True
+
+class Metrics:
+    # This class writes snapshot of statistics of all samples to the file while reads are trimmed (see parameter -metrics)
+    # Statistics are kept only as counters (see Sample), so they do not grow with the number of reads
+    # Snapshot is written not more often than once per interval seconds and at the end of trimming
+    # It is written to temporary file that replaces the previous snapshot, so the file always contains whole snapshot
+    # If name of file ends with .json, snapshot is written in JSON format. Otherwise it is written as tab-separated file
+    def __init__(self,fileName,interval,samples,ampliconNames):
+        self.fileName=fileName
+        self.interval=interval
+        self.samples=samples
+        self.ampliconNames=ampliconNames
+        self.startTime=time.perf_counter()
+        self.lastTime=self.startTime
+
+    def update(self,finished=False):
+        # Write snapshot if interval has passed since the previous one
+        now=time.perf_counter()
+        if finished or now-self.lastTime>=self.interval:
+            self.write(now-self.startTime,finished)
+            self.lastTime=now
+
+    def makeSnapshot(self,wallTime,finished):
+        snapshot={'wallTime':round(wallTime,3),'finished':finished,
+                  'reads':sum(sample.doneWork for sample in self.samples),'samples':[]}
+        for sample in self.samples:
+            dimersNum=sum(item[0] for item in sample.primerDimers.values())
+            snapshot['samples'].append({
+                'sample':sample.name,'finished':sample.closed,'reads':sample.doneWork,'trimmed':sample.trimmedNum,
+                'untrimmed':sample.doneWork-sample.trimmedNum-dimersNum,'primerDimers':dimersNum,
+                'amplicons':[{'amplicon':self.ampliconNames[num],'trimmed':nums[0],'untrimmed':nums[1]}
+                             for num,nums in sorted(sample.ampliconsNums.items())],
+                'primersErrors':[{'primer':str(num+1)+side,'reads':item[0],'withoutErrors':item[1],
+                                  'sequencingErrors':item[2],'synthesisErrors':item[3]}
+                                 for num,items in sorted(sample.primersErrors.items()) for side,item in zip('FR',items)],
+                'errorsPositions':dict(sorted(sample.primersErrorsPos.items())),
+                'errorsTypes':{str(key):value for key,value in sample.primersErrorsType.items()},
+                'dimers':[{'primerDimer':key,'readPairs':item[0],'checkedReadPairs':item[1]}
+                                for key,item in sorted(sample.primerDimers.items(),key=itemgetter(1),reverse=True)]})
+        return(snapshot)
+
+    def write(self,wallTime,finished=False):
+        snapshot=self.makeSnapshot(wallTime,finished)
+        file=open(self.fileName+'.tmp','w')
+        if self.fileName.endswith('.json'):
+            json.dump(snapshot,file,indent=1)
+            file.write('\n')
+        else:
+            file.write('\t'.join(['Wall time (s)','Finished','Reads'])+'\n')
+            file.write('\t'.join(map(str,[snapshot['wallTime'],snapshot['finished'],snapshot['reads']]))+'\n\n')
+            file.write('\t'.join(['Sample','Finished','Reads','Trimmed','Untrimmed','Primer-dimers'])+'\n')
+            for values in snapshot['samples']:
+                file.write('\t'.join(map(str,[values['sample'],values['finished'],values['reads'],values['trimmed'],
+                                              values['untrimmed'],values['primerDimers']]))+'\n')
+            # Other tables are written for all samples one after another
+            tables=[('amplicons',['Amplicon','Trimmed','Untrimmed'],['amplicon','trimmed','untrimmed']),
+                    ('primersErrors',['Primer','Total_number_of_reads','Number_without_any_errors',
+                                      'Number_with_sequencing_errors','Number_with_synthesis_errors'],
+                     ['primer','reads','withoutErrors','sequencingErrors','synthesisErrors']),
+                    ('dimers',['Primer-dimer','Number of read pairs','Number of checked read pairs'],
+                     ['primerDimer','readPairs','checkedReadPairs'])]
+            for table,header,keys in tables:
+                file.write('\n'+'\t'.join(['Sample']+header)+'\n')
+                for values in snapshot['samples']:
+                    for row in values[table]:
+                        file.write('\t'.join(map(str,[values['sample']]+[row[key] for key in keys]))+'\n')
+            for table,header in [('errorsPositions','Position_in_primer'),('errorsTypes','Error_type')]:
+                file.write('\n'+'\t'.join(['Sample',header,'Number_of_mutations'])+'\n')
+                for values in snapshot['samples']:
+                    for key,value in values[table].items():
+                        file.write('\t'.join(map(str,[values['sample'],key,value]))+'\n')
+        file.close()
+        os.replace(self.fileName+'.tmp',self.fileName)
+
+class Checkpoint:
+    # This class saves state of trimming of all samples to the file, so trimming can be continued after interruption (see parameter -resume)
+    # State contains numbers of batches and reads that have been written, offsets in input files after them,
+    # sizes of output files and statistics (see Sample.getState)
+    # Results of batches are written in the order of batches, so all reads before the last written batch have been written
+    # State is saved not more often than once per interval seconds and at the end of trimming
+    # It is written to temporary file that replaces the previous one, so the file always contains the whole state
+    # key - parameters of trimming. Trimming can be continued only with the same parameters
+    def __init__(self,fileName,interval,samples,key):
+        self.fileName=fileName
+        self.interval=interval
+        self.samples=samples
+        self.key=key
+        self.lastTime=time.perf_counter()
+
+    def update(self,finished=False):
+        # Save state if interval has passed since the previous one
+        now=time.perf_counter()
+        if finished or now-self.lastTime>=self.interval:
+            self.write()
+            self.lastTime=now
+
+    def write(self):
+        with open(self.fileName+'.tmp','wb') as file:
+            pickle.dump({'key':self.key,'samples':[sample.getState() for sample in self.samples]},file)
+        os.replace(self.fileName+'.tmp',self.fileName)
+
+def loadCheckpoint(checkpointFile,key,samples):
+    # This function restores state of samples from the checkpoint file (see Checkpoint)
+    # It returns False if there is no checkpoint file
+    if not os.path.exists(checkpointFile):
+        return(False)
+    try:
+        with open(checkpointFile,'rb') as file:
+            checkpoint=pickle.load(file)
+    except Exception:
+        print('########')
+        print('ERROR! Could not read checkpoint file:',checkpointFile)
+        print('########')
+        exit(0)
+    if checkpoint['key']!=key or [(state['name'],state['readsFileR1'],state['readsFileR2']) for state in checkpoint['samples']]!=[(sample.name,sample.readsFileR1,sample.readsFileR2) for sample in samples]:
+        print('########')
+        print('ERROR! Checkpoint file was made for other samples or parameters:',checkpointFile)
+        print('########')
+        exit(0)
+    for sample,state in zip(samples,checkpoint['samples']):
+        sample.restoreState(state)
+    return(True)
+
+def readSampleSheet(sampleSheet,args):
+    # This function reads tab-separated file with samples
+    # Columns: name of sample, file with R1 reads, file with R2 reads (or "-"), prefix for output files
+    # Names of output files are made by adding names from parameters -tr1, -tr2, -utr1, -utr2, -stat and -idimer to the prefix
+    # Empty lines and lines beginning with # are skipped
+    samples=[]
+    try:
+        file=open(sampleSheet)
+    except FileNotFoundError:
+        print('########')
+        print('ERROR! File not found:',sampleSheet)
+        print('########')
+        exit(0)
+    for string in file:
+        if string.strip()=='' or string[0]=='#':
+            continue
+        cols=string.rstrip('\r\n').split('\t')
+        if len(cols)<4:
+            print('ERROR: each line of sample sheet should contain 4 columns: name of sample, R1-file, R2-file and prefix for output files')
+            print(string)
+            exit(0)
+        name,readsFileR1,readsFileR2,prefix=cols[:4]
+        if readsFileR2 in ['','-']:
+            readsFileR2=None
+        outputFiles=[]
+        for outputFile in [args.trimmedReadsR1,args.trimmedReadsR2,args.untrimmedReadsR1,args.untrimmedReadsR2,args.primersStatistics,args.idimer]:
+            if outputFile:
+                outputFiles.append(prefix+outputFile)
+            else:
+                outputFiles.append(None)
+        samples.append(Sample(name,readsFileR1,readsFileR2,*outputFiles,ordered=args.ordered))
+    file.close()
+    if len(samples)==0:
+        print('ERROR: sample sheet does not contain any sample')
+        exit(0)
+    if len(set(sample.readsFileR2 is None for sample in samples))>1:
+        print('ERROR: all samples in sample sheet should be either paired-end or single-end')
+        exit(0)
+    # Samples should not write to the same files, otherwise they would overwrite output of each other
+    # Trimmed and untrimmed reads of one sample may be written to the same file, so files are compared only between samples
+    sampleNames=set()
+    outputFileSamples={}
+    for sample in samples:
+        if sample.name in sampleNames:
+            print('########')
+            print('ERROR! Sample sheet contains several samples with the same name:',sample.name)
+            print('########')
+            exit(0)
+        sampleNames.add(sample.name)
+        outputFiles=[sample.trimmedReadsR1,sample.trimmedReadsR2,sample.untrimmedReadsR1,sample.untrimmedReadsR2,sample.primersStatistics,sample.idimer]
+        for outputFile in set(os.path.abspath(outputFile) for outputFile in outputFiles if outputFile):
+            if outputFile in outputFileSamples:
+                print('########')
+                print('ERROR! Samples',outputFileSamples[outputFile],'and',sample.name,'have the same output file:',outputFile)
+                print('Use different prefixes for output files of samples in the sample sheet')
+                print('########')
+                exit(0)
+            outputFileSamples[outputFile]=sample.name
+    return(samples)
+
+# Functions that are replaced in each process with functions that keep results in cache or measure time (see initializer)
+# Original functions are kept here, so wrappers are always made from them, even if initializer is called several times in one process
+originalFunctions={'trimPrimers':trimPrimers,'findCandidatePrimers':findCandidatePrimers,'countDifs':countDifs,'getErrors':getErrors,
+                   'checkSynthesisError':checkSynthesisError,'isPrimerDimer':isPrimerDimer}
+
 if __name__ == "__main__":    
     # Section of reading arguments
     par=argparse.ArgumentParser(description='This script cuts primers from reads sequences')
-    par.add_argument('--readsFile_r1','-r1',dest='readsFile1',type=str,help='file with R1 reads of one sample',required=True)
+    par.add_argument('--readsFile_r1','-r1',dest='readsFile1',type=str,help='file with R1 reads of one sample',required=False)
     par.add_argument('--readsFile_r2','-r2',dest='readsFile2',type=str,help='file with R2 reads of one sample',required=False)
     par.add_argument('--primersFileR1_5','-pr15',dest='primersFileR1_5',type=str,help='fasta-file with sequences of primers on the 5\'-end of R1 reads',required=True)
     par.add_argument('--primersFileR2_5','-pr25',dest='primersFileR2_5',type=str,help='fasta-file with sequences of primers on the 5\'-end of R2 reads. Do not use this parameter if you have single-end reads',required=False)
     par.add_argument('--primersFileR1_3','-pr13',dest='primersFileR1_3',type=str,help='fasta-file with sequences of primers on the 3\'-end of R1 reads. It is not required. But if it is determined, -pr23 is necessary',required=False)
     par.add_argument('--primersFileR2_3','-pr23',dest='primersFileR2_3',type=str,help='fasta-file with sequences of primers on the 3\'-end of R2 reads',required=False)
-    par.add_argument('--trimmedReadsR1','-tr1',dest='trimmedReadsR1',type=str,help='name of file for trimmed R1 reads',required=True)
+    par.add_argument('--trimmedReadsR1','-tr1',dest='trimmedReadsR1',type=str,help='name of file for trimmed R1 reads',required=False)
     par.add_argument('--trimmedReadsR2','-tr2',dest='trimmedReadsR2',type=str,help='name of file for trimmed R2 reads',required=False)
-    par.add_argument('--untrimmedReadsR1','-utr1',dest='untrimmedReadsR1',type=str,help='name of file for untrimmed R1 reads. If you want to write reads that has not been trimmed to the same file as trimmed reads, type the same name',required=True)
+    par.add_argument('--untrimmedReadsR1','-utr1',dest='untrimmedReadsR1',type=str,help='name of file for untrimmed R1 reads. If you want to write reads that has not been trimmed to the same file as trimmed reads, type the same name',required=False)
     par.add_argument('--untrimmedReadsR2','-utr2',dest='untrimmedReadsR2',type=str,help='name of file for untrimmed R2 reads. If you want to write reads that has not been trimmed to the same file as trimmed reads, type the same name',required=False)
     par.add_argument('--primersStatistics','-stat',dest='primersStatistics',type=str,help='name of file for statistics of errors in primers. This works only for paired-end reads with primers at 3\'- and 5\'-ends',required=False)
     par.add_argument('--error-number','-err',dest='errNumber',type=int,help='number of errors (substitutions, insertions, deletions) that allowed during searching primer sequence in a read sequence. Default: 5',default=5)
     par.add_argument('--primer-location-buffer','-plb',dest='primerLocBuf',type=int,help='Buffer of primer location in the read from the start or end of read. If this value is zero, than cutPrimers will search for primer sequence in the region of the longest primer length. Default: 10',default=10)
-    par.add_argument('--min-primer3-length','-primer3len',dest='minPrimer3Len',type=int,help="Minimal length of primer on the 3'-end to trim. Use this parameter, if you are ready to trim only part of primer sequence of the 3'-end of read")
+    par.add_argument('--min-primer3-length','-primer3len',dest='minPrimer3Len',type=int,help="Minimal length of primer on the 3'-end to trim. Use this parameter, if you are ready to trim only part of primer sequence of the 3'-end of read. If the whole primer is not found, its prefixes are searched at the end of read from the longest one down to this length. Number of allowed errors is decreased proportionally to the length of prefix")
     par.add_argument('--primer3-absent','-primer3',dest='primer3absent',action='store_true',help="if primer at the 3'-end may be absent, use this parameter")
     par.add_argument('--identify-dimers','-idimer',dest='idimer',type=str,help='use this parameter if you want to get statistics of homo- and heterodimer formation. Choose file to which statistics of primer-dimers will be written. This parameter may slightly decrease the speed of analysis')
+    par.add_argument('--matcher','-matcher',dest='matcherType',type=str,choices=['regex','myers'],help="algorithm for searching primers in reads: 'regex' - fuzzy regular expressions; 'myers' - the minimal number of errors is calculated with the bit-parallel algorithm of Myers before using regular expression, that is much faster for reads without primers and gives the same result. Default: regex",default='regex')
+    par.add_argument('--locator','-locator',dest='locatorType',type=str,choices=['hash','aho'],help="algorithm for searching candidate primers: 'hash' - primers with the largest number of common parts with the read; 'aho' - all parts of primers are found with Aho-Corasick automaton and votes are counted only for parts on the same diagonal, and primers are checked by parts before searching them. Use 'aho' for large panels. Candidate primers of 'aho' may differ from 'hash', so 'aho' can change which reads are trimmed. 'hash' gives the same result as earlier versions of cutPrimers. Default: hash",default='hash')
+    par.add_argument('--alignment-cache-size','-acs',dest='alignmentCacheSize',type=int,help='number of results of alignments of found and designed primer sequences that are kept in memory of each process. Alignments are used for statistics of errors (-stat) and identification of primer-dimers (-idimer). Use 0 to switch it off. Default: 65536',default=65536)
+    par.add_argument('--sample-sheet','-ss',dest='sampleSheet',type=str,help='tab-separated file with columns: name of sample, file with R1 reads, file with R2 reads (or "-" for single-end reads), prefix for output files. Use it to trim many samples at once with the same primers. In this case, -r1 and -r2 are not used, and names of output files (-tr1, -tr2, -utr1, -utr2, -stat, -idimer) are added to the prefix of each sample',required=False)
+    par.add_argument('--primer-index-cache','-pic',dest='primerIndexCache',type=str,help='file for cache of primers index. If this file was made for the same primer files and parameters (-err, -plb, -primer3len, -locator), index of primers is loaded from it. Otherwise index is made and saved to this file. Index contains sequences of primers, hashes of their parts and structures for searching candidate primers (arrays of hashes or automaton of -locator aho), so processes do not make them again. Regular expressions are compiled by each process, because they can not be saved. Use it if you process many samples with the same primers',required=False)
+    par.add_argument('--ordered','-ord',dest='ordered',action='store_true',help='use this parameter if you want reads in output files to be in the same order as in input files. Batches of reads are still trimmed in parallel, but results are written in the order of batches. Output files are the same for any number of threads and batch size. Gzipped files of amplicons (-split) and gzipped files written with checkpoints (-cp) may be divided into other compressed blocks, but their decompressed content is the same')
+    par.add_argument('--overlap','-overlap',dest='overlap',action='store_true',help="use this parameter if R1 and R2 reads of most pairs overlap through the whole amplicon. Then primer at the 3'-end of each read is searched at first as reverse complement of the sequence of primer found at the 5'-end of the other read. It is searched without errors, so primers with the same synthesis errors in both reads are found without fuzzy search. If it is not found, primer is searched as usual. It is used only for primers at the 3'-ends that are reverse complement to primers at the 5'-ends. Found sequence is used only if fuzzy search can not find primer at other position with the same or smaller number of errors (it is checked with the algorithm of Myers), so trimmed reads and statistics are the same as without this parameter")
+    par.add_argument('--split-amplicons','-split',dest='splitAmplicons',action='store_true',help='use this parameter if you want to write trimmed reads of each amplicon to separate files. Name of amplicon (name of primer from -pr15 file) is added to the beginning of names of files from -tr1 and -tr2, e.g. AMP1_trimmed_R1.fastq.gz. Symbols "/" in names are replaced with "_". If several primers have the same name, their numbers in the -pr15 file are added to their names, e.g. AMP1_2_trimmed_R1.fastq.gz. Files -tr1 and -tr2 are not created, if untrimmed reads are not written to them')
+    par.add_argument('--max-open-files','-mof',dest='maxOpenFiles',type=int,help='maximal number of files of amplicons (see -split) that are open at once for each of R1 and R2 reads. Default: 256',default=256)
+    par.add_argument('--reads-index','-ri',dest='readsIndex',action='store_true',help='use this parameter if you want processes to read chunks of reads from input files themselves. Offsets of chunks of -bs reads are saved to the index file near the reads file (with extension .cpi) and are used in the next runs, if the reads file was not changed. Input files should be not compressed or compressed with bgzip. Use it if reading of reads by the main process is too slow for the number of threads')
+    par.add_argument('--part','-part',dest='part',type=str,help='part of reads that should be trimmed in the format K/N, e.g. 2/8 means the second part of eight. Reads are divided by chunks of index (see -ri), so this parameter switches on -ri. Use it to trim one sample on several computers. Output files of parts in the order of their numbers can be concatenated (e.g. with "cat"). Statistics (-stat, -idimer) are written for each part separately',required=False)
+    par.add_argument('--profile','-prof',dest='profile',type=str,help='file for report with time and counters of each stage of trimming and of searching each primer. If name of file ends with .json, report is written in JSON format. Otherwise it is written as tab-separated file. Time of stages is summed for all processes',required=False)
+    par.add_argument('--metrics','-metrics',dest='metrics',type=str,help='file for snapshot of statistics that is updated while reads are trimmed: numbers of processed, trimmed and untrimmed reads of each sample and amplicon, errors in primers (-stat) and primer-dimers (-idimer). If name of file ends with .json, it is written in JSON format. Otherwise it is written as tab-separated file. The file is replaced with a new snapshot at once, so it can be read at any time',required=False)
+    par.add_argument('--metrics-interval','-mi',dest='metricsInterval',type=float,help='minimal time in seconds between updates of file with statistics (see -metrics). Default: 60',default=60)
+    par.add_argument('--checkpoint','-cp',dest='checkpoint',type=str,help='file for saving state of trimming: numbers of reads that have been written, offsets in input files, sizes of output files and statistics. If trimming is interrupted, it can be continued from this state with parameter -resume. This parameter switches on -ord',required=False)
+    par.add_argument('--checkpoint-interval','-ci',dest='checkpointInterval',type=float,help='minimal time in seconds between savings of state of trimming (see -cp). Default: 60',default=60)
+    par.add_argument('--resume','-resume',dest='resume',action='store_true',help='use this parameter to continue interrupted trimming from the state saved in the checkpoint file (see -cp). Output files are truncated to their sizes from the checkpoint, and reading of input files continues from their offsets saved in the checkpoint. Gzipped files that are not BGZF can not be read from the middle, so they are decompressed from the start and reads that have been already written are skipped. All other parameters should be the same. If checkpoint file does not exist, trimming begins from the start')
     par.add_argument('--threads','-t',dest='threads',type=int,help='number of threads',default=2)
+    par.add_argument('--batch-size','-bs',dest='batchSize',type=int,help='number of reads (or read pairs) that are sent to one process at once. Default: 1000',default=1000)
+    par.add_argument('--compression-level','-cl',dest='compressionLevel',type=int,choices=range(1,10),metavar='[1-9]',help='level of compression for gzipped output files. Output files are compressed by blocks in several threads (their number is set by -t parameter). Default: 9',default=9)
     args=par.parse_args()
     print('The command was:\n',' '.join(sys.argv))
-    readsFileR1=args.readsFile1
-    readsFileR2=args.readsFile2
+    startTime=time.perf_counter()
     primersFileR1_5=args.primersFileR1_5
     primersFileR2_5=args.primersFileR2_5
     primersFileR1_3=args.primersFileR1_3
@@ -301,383 +2524,216 @@ if __name__ == "__main__":
     primerLocBuf=args.primerLocBuf
     primersStatistics=args.primersStatistics
     idimer=args.idimer
-    if (primersFileR1_3 and not primersFileR1_5) or (not primersFileR2_5 and primersFileR2_3):
-        print('ERROR: use of -pr13 or -pr23 should be accompanied by use of second one parameter for 5\'-end')
+    threads=int(args.threads)
+    if args.profile:
+        checkOutputFile(args.profile)
+        profile=Profile()
+    else:
+        profile=None
+    batchSize=args.batchSize
+    if args.alignmentCacheSize<0:
+        print('ERROR: size of cache of alignments should not be negative')
         exit(0)
-    if (not readsFileR2 and primersFileR2_5) or (not readsFileR2 and primersFileR2_3):
-        print('ERROR: use of -pr23 or -pr25 should be accompanied by use of readsFile2 parameter')
+    if batchSize<1:
+        print('ERROR: batch size should be a positive number')
         exit(0)
-    if readsFileR2 and not primersFileR2_5:
-        print('ERROR: use of -r2 parameter should be accompanied by use of at least -pr25 parameter')
+    if args.metrics:
+        checkOutputFile(args.metrics)
+    if args.resume and not args.checkpoint:
+        print('ERROR: use of -resume parameter should be accompanied by use of -cp parameter')
         exit(0)
-    try:
-        if args.trimmedReadsR1[-3:]!='.gz':
-            trimmedReadsR1=open(args.trimmedReadsR1,'w')
-        else:
-            trimmedReadsR1=gzip.open(args.trimmedReadsR1,'wt')
-    except FileNotFoundError:
-        print('########')
-        print('ERROR! Could not create file:',args.trimmedReadsR1)
-        print('########')
+    if args.checkpoint:
+        checkOutputFile(args.checkpoint)
+        # State can be saved only if all reads before the last written batch have been written
+        args.ordered=True
+    if args.checkpointInterval<0:
+        print('ERROR: interval between savings of state of trimming should not be negative')
         exit(0)
-    if args.untrimmedReadsR1==args.trimmedReadsR1:
-        untrimmedReadsR1=trimmedReadsR1
-    else:
+    if args.metricsInterval<0:
+        print('ERROR: interval between updates of statistics should not be negative')
+        exit(0)
+    if args.maxOpenFiles<1:
+        print('ERROR: maximal number of open files should be a positive number')
+        exit(0)
+    # part - number of part of reads and number of parts
+    part=(1,1)
+    if args.part:
         try:
-            if args.untrimmedReadsR1[-3:]!='.gz':
-                untrimmedReadsR1=open(args.untrimmedReadsR1,'w')
-            else:
-                untrimmedReadsR1=gzip.open(args.untrimmedReadsR1,'wt')
-        except FileNotFoundError:
-            print('########')
-            print('ERROR! Could not create file:',args.untrimmedReadsR1)
-            print('########')
+            part=tuple(int(x) for x in args.part.split('/'))
+        except ValueError:
+            part=()
+        if len(part)!=2 or not 1<=part[0]<=part[1]:
+            print('ERROR: part of reads should be in the format K/N, where K is not greater than N, e.g. 2/8')
             exit(0)
-    if args.trimmedReadsR2:
-        try:
-            if args.trimmedReadsR2[-3:]!='.gz':
-                trimmedReadsR2=open(args.trimmedReadsR2,'w')
-            else:
-                trimmedReadsR2=gzip.open(args.trimmedReadsR2,'wt')
-        except FileNotFoundError:
-            print('########')
-            print('ERROR! Could not create file:',args.trimmedReadsR2)
-            print('########')
+        args.readsIndex=True
+    if (primersFileR1_3 and not primersFileR1_5) or (not primersFileR2_5 and primersFileR2_3):
+        print('ERROR: use of -pr13 or -pr23 should be accompanied by use of second one parameter for 5\'-end')
+        exit(0)
+    if not args.trimmedReadsR1 or not args.untrimmedReadsR1:
+        print('ERROR: use of -tr1 and -utr1 parameters is required')
+        exit(0)
+    if args.sampleSheet:
+        samples=readSampleSheet(args.sampleSheet,args)
+    elif args.readsFile1:
+        samples=[Sample('',args.readsFile1,args.readsFile2,args.trimmedReadsR1,args.trimmedReadsR2,
+                        args.untrimmedReadsR1,args.untrimmedReadsR2,args.primersStatistics,args.idimer,args.ordered)]
+    else:
+        print('ERROR: use of -r1 or -ss parameter is required')
+        exit(0)
+    for sample in samples:
+        if (not sample.readsFileR2 and primersFileR2_5) or (not sample.readsFileR2 and primersFileR2_3):
+            print('ERROR: use of -pr23 or -pr25 should be accompanied by use of readsFile2 parameter')
             exit(0)
-    if args.untrimmedReadsR2:
-        if args.untrimmedReadsR2==args.trimmedReadsR2:
-            untrimmedReadsR2=trimmedReadsR2
-        else:
+        if sample.readsFileR2 and not primersFileR2_5:
+            print('ERROR: use of -r2 parameter should be accompanied by use of at least -pr25 parameter')
+            exit(0)
+        if sample.readsFileR2 and (not sample.trimmedReadsR2 or not sample.untrimmedReadsR2):
+            print('ERROR: use of -r2 parameter should be accompanied by use of -tr2 and -utr2 parameters')
+            exit(0)
+        sample.checkFiles()
+        if args.readsIndex:
+            for readsFile in [sample.readsFileR1,sample.readsFileR2]:
+                if readsFile and readsFile[-3:]=='.gz' and not isBgzf(readsFile):
+                    print('ERROR: chunks of reads can be read only from files that are not compressed or are compressed with bgzip:',readsFile)
+                    exit(0)
+            # Indexes are made before trimming, so later they are only loaded from sidecar-files
+            # Numbers of reads in R1 and R2 files are compared here, before processes are started
             try:
-                if args.untrimmedReadsR2[-3:]!='.gz':
-                    untrimmedReadsR2=open(args.untrimmedReadsR2,'w')
-                else:
-                    untrimmedReadsR2=gzip.open(args.untrimmedReadsR2,'wt')
-            except FileNotFoundError:
+                readsNums=[loadReadsIndex(readsFile,batchSize)[1] for readsFile in [sample.readsFileR1,sample.readsFileR2] if readsFile]
+            except ValueError as e:
+                print('########')
+                print('ERROR!',e)
+                print('########')
+                exit(0)
+            if len(set(readsNums))>1:
                 print('########')
-                print('ERROR! Could not create file:',args.untrimmedReadsR2)
+                print('ERROR! Numbers of reads in R1 and R2 files are different:',sample.readsFileR1,sample.readsFileR2)
                 print('########')
                 exit(0)
+    # readsFileR2 shows if reads are paired-end. It is the same for all samples
+    readsFileR2=samples[0].readsFileR2
     if idimer and not readsFileR2:
         print('Warning! You did not provide R2-file so parameter "-idimer" will be ignored')
         idimer=None
-    if idimer:
-        try:
-            idimerFile=open(idimer,'w')
-        except FileNotFoundError:
-            print('########')
-            print('ERROR! Could not create file:',idimer)
-            print('########')
-            exit(0)
-        primerDimers={}
-    if primersStatistics:
-        primersStatistics=open(args.primersStatistics,'w')
-        primersStatisticsPos=open(args.primersStatistics[:-4]+'_poses.tab','w')
-        primersStatisticsType=open(args.primersStatistics[:-4]+'_types.tab','w')
-    threads=int(args.threads)
+        for sample in samples:
+            sample.idimer=None
 
     # Read fasta-files with sequences of primers
-    print('Reading files of primers...')
-    lastPrimerNum=0
-    # maxPrimerLen - variable that contains length of the longest primer
-    maxPrimerLen=0
-    # primers in R1 on the 5'-end
-    primersR1_5=[]
-    primersR1_5_names=[]
-    primerR1_5_hashes={}
-    primerR1_5_hashLens=set()
-    primerR2_5_hashes={}
-    primerR2_5_hashLens=set()
-    i=0
-    try:
-        for r in SeqIO.parse(primersFileR1_5,'fasta'):
-            primersR1_5_names.append(r.name)
-            primersR1_5.append('('+str(r.seq)+')')
-            partLens=math.floor(len(r.seq)/(int(errNumber)+1))
-            hashes,lens=makeHashes(str(r.seq),partLens)
-            primerR1_5_hashLens.update(lens)
-            for h in hashes:
-                if h in primerR1_5_hashes.keys():
-                    primerR1_5_hashes[h].append(i)
-                else:
-                    primerR1_5_hashes[h]=[i]
-            if len(r.seq)>maxPrimerLen:
-                maxPrimerLen=len(r.seq)
-            i+=1
-    except FileNotFoundError:
-        print('########')
-        print('ERROR! File not found:',primersFileR1_5)
-        print('########')
-        exit(0)
-    # primers in R2 on the 5'-end
-    if primersFileR2_5:
-        primersR2_5=[]
-        primersR2_5_names=[]
-        i=0
+    # If file for cache of primers index is determined and it was made for the same primers and parameters,
+    # index is loaded from it. Else it is made from fasta-files and is saved to the cache file
+    primerIndex=None
+    primerIndexKey=None
+    if args.primerIndexCache:
         try:
-            for r in SeqIO.parse(primersFileR2_5,'fasta'):
-                primersR2_5_names.append(r.name)
-                primersR2_5.append('('+str(r.seq)+')')
-                partLens=math.floor(len(r.seq)/(int(errNumber)+1))
-                hashes,lens=makeHashes(str(r.seq),partLens)
-                primerR2_5_hashLens.update(lens)
-                for h in hashes:
-                    if h in primerR2_5_hashes.keys():
-                        primerR2_5_hashes[h].append(i)
-                    else:
-                        primerR2_5_hashes[h]=[i]
-                if len(r.seq)>maxPrimerLen:
-                    maxPrimerLen=len(r.seq)
-                i+=1
-        except FileNotFoundError:
+            primerIndexKey=makePrimerIndexKey(primersFileR1_5,primersFileR2_5,primersFileR1_3,primersFileR2_3,errNumber,primerLocBuf,minPrimer3Len,
+                                             args.locatorType)
+        except FileNotFoundError as e:
             print('########')
-            print('ERROR! File not found:',primersFileR2_5)
+            print('ERROR! File not found:',e.filename)
             print('########')
             exit(0)
+        primerIndex=loadPrimerIndex(args.primerIndexCache,primerIndexKey)
+        if primerIndex:
+            print('Index of primers was loaded from',args.primerIndexCache)
+    if not primerIndex:
+        print('Reading files of primers...')
+        primerIndex=readPrimers(primersFileR1_5,primersFileR2_5,primersFileR1_3,primersFileR2_3,errNumber)
+        primerIndex=makePrimerSearchIndex(primerIndex,errNumber,primerLocBuf,args.locatorType)
+        if args.primerIndexCache:
+            savePrimerIndex(args.primerIndexCache,primerIndexKey,primerIndex)
+    # maxPrimerLen - variable that contains length of the longest primer
+    maxPrimerLen=primerIndex['maxPrimerLen']
+    primersR1_5=primerIndex['primersR1_5']
+    primersR1_5_names=primerIndex['primersR1_5_names']
+    primersR2_5=primerIndex['primersR2_5']
+    primersR2_5_names=primerIndex['primersR2_5_names']
+    primersR1_3=primerIndex['primersR1_3']
+    primersR2_3=primerIndex['primersR2_3']
+    # Untrimmed reads may be written to the same files as trimmed reads
+    # Names of output files of all samples are made from the same parameters, so it is the same for all samples
+    # If trimmed reads of each amplicon are written to separate files, files of trimmed reads contain only untrimmed reads
+    if args.splitAmplicons:
+        untrimmedToTrimmed=(False,False)
     else:
-        primersR2_5=None
-    # primers in R1 on the 3'-end
-    if primersFileR1_3:
-        primersR1_3=[]
-        primersR1_3_names=[]
-        try:
-            for r in SeqIO.parse(primersFileR1_3,'fasta'):
-                primersR1_3_names.append(r.name)
-                primersR1_3.append('('+str(r.seq)+')')
-                if len(r.seq)>maxPrimerLen:
-                    maxPrimerLen=len(r.seq)
-        except FileNotFoundError:
-            print('########')
-            print('ERROR! File not found:',primersFileR1_3)
-            print('########')
-            exit(0)
+        untrimmedToTrimmed=(args.untrimmedReadsR1==args.trimmedReadsR1,args.untrimmedReadsR2==args.trimmedReadsR2)
+    # Create Pool for multiprocessing
+    # Index of primers that was made or loaded from the cache file is sent to each process,
+    # so processes do not depend on the cache file that may be not written or replaced by other run
+    p=Pool(threads,initializer,(primerIndex,primerLocBuf,errNumber,
+                                primersFileR1_3,primersFileR2_5,primersFileR2_3,readsFileR2,primersStatistics,idimer,primer3absent,minPrimer3Len,args.matcherType,untrimmedToTrimmed,profile is not None,args.locatorType,args.alignmentCacheSize,
+                                args.splitAmplicons,args.overlap))
+    # Cutting primers and writing result immediately
+    # Batches of all samples are sent to the same pool of processes one by one
+    # Files of each sample are opened when its first batch is read and are closed when its last result is written
+    # Not more than 4 batches per process are kept in memory
+    # Batch is released only after it is written, so if output is ordered, this also limits the number of batches
+    # that wait for previous batches
+    print('Trimming primers from reads...')
+    inFlight=threading.Semaphore(4*threads)
+    def readAllBatches():
+        for sampleNum,sample in enumerate(samples):
+            if sample.closed:
+                continue
+            with sample.lock:
+                sample.openFiles(args.compressionLevel,threads,batchSize,args.readsIndex,part,
+                                 primersR1_5_names if args.splitAmplicons else None,args.maxOpenFiles)
+            yield from sample.readBatches(sampleNum,inFlight)
+    # If trimming is continued, state of samples is restored from the checkpoint file
+    # Parameters that change output files should be the same as in the interrupted run
+    if args.checkpoint:
+        checkpointKey={key:value for key,value in vars(args).items()
+                       if key not in ['resume','threads','compressionLevel','checkpointInterval','metrics','metricsInterval','profile','maxOpenFiles']}
+        if args.resume:
+            if loadCheckpoint(args.checkpoint,checkpointKey,samples):
+                print('Trimming is continued from the checkpoint',args.checkpoint)
+            else:
+                print('Warning! Checkpoint file was not found, so trimming begins from the start:',args.checkpoint)
+        checkpoint=Checkpoint(args.checkpoint,args.checkpointInterval,samples,checkpointKey)
     else:
-        primersR1_3=None
-    # primers in R2 on the 3'-end
-    if primersFileR2_3:
-        primersR2_3=[]
-        primersR2_3_names=[]
-        try:
-            for r in SeqIO.parse(primersFileR2_3,'fasta'):
-                primersR2_3_names.append(r.name)
-                primersR2_3.append('('+str(r.seq)+')')
-                if len(r.seq)>maxPrimerLen:
-                    maxPrimerLen=len(r.seq)
-        except FileNotFoundError:
-            print('########')
-            print('ERROR! File not found:',primersFileR2_3)
-            print('########')
-            exit(0)
+        checkpoint=None
+    if args.metrics:
+        metrics=Metrics(args.metrics,args.metricsInterval,samples,primersR1_5_names)
     else:
-        primersR2_3=None
-    # Read file with R1 and R2 reads
+        metrics=None
+    showPercWork(0,1)
+    # alignmentCacheCounts - numbers of hits and misses of caches of alignments in all processes
+    alignmentCacheCounts=[0,0]
+    # Errors in input files are raised as ValueError in the thread that reads batches or in processes,
+    # and are passed to the main process
     try:
-        if readsFileR1[-3:]!='.gz':
-            allWork=open(readsFileR1).read().count('\n')/4
-        else:
-            allWork=gzip.open(readsFileR1,'rt').read().count('\n')/4
-    except FileNotFoundError:
+        for res in p.imap_unordered(trimBatch,readAllBatches()):
+            alignmentCacheCounts[0]+=res[10][0]
+            alignmentCacheCounts[1]+=res[10][1]
+            if profile is not None:
+                profile.merge(res[9])
+            for i in range(samples[res[0]].writeResult(res)):
+                inFlight.release()
+            for sample in samples[:res[0]+1]:
+                if not sample.closed and sample.allBatchesRead() and sample.batchesDone==sample.batchesNum:
+                    print()
+                    sample.close()
+            if metrics is not None:
+                metrics.update()
+            if checkpoint is not None:
+                checkpoint.update()
+    except ValueError as e:
+        p.terminate()
+        print()
         print('########')
-        print('ERROR! Could not open file:',readsFileR1)
+        print('ERROR!',e)
         print('########')
         exit(0)
-    print('Reading input FASTQ-file(s)...')
-    if readsFileR1[-3:]!='.gz':
-        data1=SeqIO.parse(readsFileR1,'fastq')
-    else:
-        data1=SeqIO.parse(gzip.open(readsFileR1,'rt'),'fastq')
-    if readsFileR2:
-        try:
-            if readsFileR2[-3:]!='.gz':
-                data2=SeqIO.parse(readsFileR2,'fastq')
-            else:
-                data2=SeqIO.parse(gzip.open(readsFileR2,'rt'),'fastq')
-        except FileNotFoundError:
-            print('########')
-            print('ERROR! Could not open file:',readsFileR2)
-            print('########')
-            exit(0)
-    else:
-        data2=['']*int(allWork)
-    # Create Queue for storing result and Pool for multiprocessing
-    primerErrorQ=[] 
-    p=Pool(threads,initializer,(maxPrimerLen,primerLocBuf,errNumber,primersR1_5,primersR1_3,primersR2_5,primersR2_3,
-                                primerR1_5_hashes,primerR1_5_hashLens,primerR2_5_hashes,primerR2_5_hashLens,
-                                primersFileR1_3,primersFileR2_5,primersFileR2_3,readsFileR2,primersStatistics,idimer,primer3absent,minPrimer3Len))
-    # Cutting primers and writing result immediately
-    print('Trimming primers from reads...')
-    doneWork=0
-    showPercWork(0,allWork)
-    for res in p.imap_unordered(trimPrimers,zip(data1,data2),10):
-        doneWork+=1
-        showPercWork(doneWork,allWork)
-        if res[1]!=[]:
-            primerErrorQ.append(res[1])
-        if readsFileR2:
-            if res[0][0][0] is not None and res[0][0][1] is not None:
-                SeqIO.write(res[0][0][0],trimmedReadsR1,'fastq')
-                SeqIO.write(res[0][0][1],trimmedReadsR2,'fastq')
-            elif res[0][1][0] is not None and res[0][1][1] is not None:
-                # If user want to identify primer-dimers
-                if idimer and res[2]:
-                    r1partSeq=str(res[0][1][0].seq[:40])
-                    r2partSeq=revComplement(str(res[0][1][1].seq[:40]))
-                    difs=countDifs(r1partSeq,r2partSeq)
-                    if sum(difs[0:2])<=int(errNumber):
-                        # and len(difs[3])>=len(primersR1_5[res[2][0]])
-                        if primersR1_5_names[res[2][0]]+' & '+primersR2_5_names[res[2][1]] not in primerDimers.keys():
-                            primerDimers[primersR1_5_names[res[2][0]]+' & '+primersR2_5_names[res[2][1]]]=1
-                        else:
-                            primerDimers[primersR1_5_names[res[2][0]]+' & '+primersR2_5_names[res[2][1]]]+=1
-                    else:
-                        SeqIO.write(res[0][1][0],untrimmedReadsR1,'fastq')
-                        SeqIO.write(res[0][1][1],untrimmedReadsR2,'fastq')
-                else:
-                    SeqIO.write(res[0][1][0],untrimmedReadsR1,'fastq')
-                    SeqIO.write(res[0][1][1],untrimmedReadsR2,'fastq')
-                        
-            else:
-                print('ERROR: nor the 1st item of function result list or 2nd contains anything')
-                print(res)
-                exit(0)
-        else:
-            if res[0][0][0] is not None:
-                SeqIO.write(res[0][0][0],trimmedReadsR1,'fastq')
-            elif res[0][1][0] is not None:
-                SeqIO.write(res[0][1][0],untrimmedReadsR1,'fastq')
-            else:
-                print('ERROR: item of function result list contains anything')
-                print(res)
-                exit(0)
-    print()
-    # primersErrors is a dictionary that contains errors in primers
-    if args.primersStatistics:
-        primersErrors={}
-        # primersErrorsPos is a dictionary that contains statistics about location
-        # of errors
-        primersErrorsPos={}
-        # primersErrorsType is a dictionary that contains statistics about type of error
-        primersErrorsType={}
-        print('Counting errors...')
-        for item in primerErrorQ:
-            # If key for this primer has not been created, yet
-            if not item[0] in primersErrors.keys():
-                # For each primer of each pair we will gather the following values:
-                # [(0)number of read pairs,
-                # (1)number of primers without errors,
-                # (2)number of primers with sequencing errors,
-                # (3)number of primers with synthesis errors
-                # The first item of list - F
-                # The second - R
-                primersErrors[item[0]]=[[0,0,0,0],[0,0,0,0]]
-                
-##          R                           F_reverse_complement
-## R1 5'---------________________________---------3'
-## R2 5'---------________________________---------3'
-##          F                           R_reverse_complement
-                
-            # Increase number of read pairs
-            primersErrors[item[0]][0][0]+=1
-            primersErrors[item[0]][1][0]+=1
-            # F-primers of pairs
-            # The last variant is a case when we have single-end reads and 3' does not contain primer sequence
-            if ((not primersFileR1_3 and primersFileR2_5 and item[3][0:3]==(0,0,0)) or
-                (primersFileR1_3 and primersFileR2_5 and item[3][0:3]==(0,0,0) and item[2][0:3]==(0,0,0)) or
-                (primersFileR1_5 and not primersFileR2_5 and not primersFileR1_3 and not primersFileR2_3)):
-                primersErrors[item[0]][0][1]+=1
-            # If it was overlapping paired-end reads, we try to check if this is sequencing error
-            elif primersFileR1_3 and primersFileR2_5 and primersFileR2_3 and item[2][3]!='' and item[3][3]!='':
-                # Rererse complement one of primer sequences
-                rev=str(Seq(item[2][3]).reverse_complement())
-                a=pairwise2.align.globalms(rev,item[3][3],2,-1,-1.53,-0.1)
-                # If found sequences are identical, it's a synthesis error
-                if list(a[0][0])==list(a[0][1]):
-                    primersErrors[item[0]][0][3]+=1
-                    # Now we want to save information about error's location
-                    poses,muts=getErrors(primersR2_5[item[0]][1:-1],item[3][3])
-                    for p in poses:
-                        if p not in primersErrorsPos.keys():
-                            primersErrorsPos[p]=1
-                        else:
-                            primersErrorsPos[p]+=1
-                    for m in muts:
-                        if m not in primersErrorsType.keys():
-                            primersErrorsType[m]=1
-                        else:
-                            primersErrorsType[m]+=1
-                # Else it's a sequencing error
-                else:
-                    primersErrors[item[0]][0][2]+=1
-            # Else we just save it as sequencing error
-            else:
-                primersErrors[item[0]][0][2]+=1
-            # R-primers of pairs
-            # For R-primer we always have sequence at least at 5' end of R1
-            if ((not primersFileR2_3 and item[1][0:3]==(0,0,0)) or
-                (primersFileR2_3 and item[1][0:3]==(0,0,0) and item[4][0:3]==(0,0,0))):
-                primersErrors[item[0]][1][1]+=1
-            # If it was overlapping paired-end reads, we try to check if this is sequencing error
-            elif primersFileR1_3 and primersFileR2_5 and primersFileR2_3 and item[4][3]!='' and item[1][3]!='':
-                # Rererse complement one of primer sequences
-                rev=str(Seq(item[4][3]).reverse_complement())
-                a=pairwise2.align.globalms(rev,item[1][3],2,-1,-1.53,-0.1)
-                # If found sequences are identical, it's a synthesis error
-                try:
-                    if list(a[0][0])==list(a[0][1]):
-                        primersErrors[item[0]][1][3]+=1
-                        # Now we want to save information about error's location
-                        poses,muts=getErrors(primersR1_5[item[0]][1:-1],item[1][3])
-                        for p in poses:
-                            if p not in primersErrorsPos.keys():
-                                primersErrorsPos[p]=1
-                            else:
-                                primersErrorsPos[p]+=1
-                        for m in muts:
-                            if m not in primersErrorsType.keys():
-                                primersErrorsType[m]=1
-                            else:
-                                primersErrorsType[m]+=1
-                    # Else it's a sequencing error
-                    else:
-                        primersErrors[item[0]][1][2]+=1
-                except IndexError:
-                    print('IndexError!',a)
-                    print(item)
-                    exit(0)
-            # Else we just save it as sequencing error
-            else:
-                primersErrors[item[0]][0][2]+=1
-        primersStatistics.write('Primer\tTotal_number_of_reads\tNumber_without_any_errors\t'
-                                'Number_with_sequencing_errors\tNumber_with_synthesis_errors\n')
-        for key,item in primersErrors.items():
-            item[0]=list(map(str,item[0]))
-            item[1]=list(map(str,item[1]))
-            primersStatistics.write(str(key+1)+'F\t'+'\t'.join(item[0])+'\n')
-            primersStatistics.write(str(key+1)+'R\t'+'\t'.join(item[1])+'\n')
-        primersStatistics.close()
-
-        primersStatisticsPos.write('Position_in_primer\tNumber_of_mutations\n')
-        for key,item in primersErrorsPos.items():
-            primersStatisticsPos.write(str(key)+'\t'+str(item)+'\n')
-        primersStatisticsPos.close()
-
-        primersStatisticsType.write('Error_type\tNumber_of_mutations\n')
-        for key,item in primersErrorsType.items():
-            primersStatisticsType.write(str(key)+'\t'+str(item)+'\n')
-        primersStatisticsType.close()
-    if idimer:
-        idimerFile.write('Primer-dimer\tNumber of read pairs\n')
-        for key,item in sorted(primerDimers.items(),key=itemgetter(1),reverse=True):
-            idimerFile.write(key+'\t'+str(item)+'\n')
-        idimerFile.close()
-
-    trimmedReadsR1.close()
-    untrimmedReadsR1.close()
-    if args.trimmedReadsR2:
-        trimmedReadsR2.close()
-        untrimmedReadsR2.close()
-
-
-
-
-        
+    for sample in samples:
+        if not sample.closed:
+            print()
+            sample.close()
+    if metrics is not None:
+        metrics.update(finished=True)
+    if checkpoint is not None:
+        checkpoint.update(finished=True)
+    if sum(alignmentCacheCounts)>0:
+        print('Alignments of primers were taken from cache:',alignmentCacheCounts[0],'of',sum(alignmentCacheCounts))
+    if profile is not None:
+        profile.write(args.profile,sum(sample.doneWork for sample in samples),time.perf_counter()-startTime,
+                      {"search R1 5'":primersR1_5_names,"search R2 5'":primersR2_5_names,
+                       "search R1 3'":primerIndex['primersR1_3_names'],"search R2 3'":primerIndex['primersR2_3_names']})
@@ -0,0 +1,288 @@
+# Tests of cutPrimers
+# Run them with: python -m pytest test_cutPrimers.py
+
+import os
+import sys
+import gzip
+import pickle
+import random
+import subprocess
+import time
+from collections import Counter
+import pytest
+from Bio import bgzf
+import cutPrimers
+import benchmarkCutPrimers
+
+exampleDir=os.path.join(os.path.dirname(os.path.abspath(__file__)),'example')
+cutPrimersFile=os.path.join(os.path.dirname(os.path.abspath(__file__)),'cutPrimers.py')
+primersFiles=[os.path.join(exampleDir,'primers_'+primerType+'.fa') for primerType in ['R1_5','R2_5','R1_3','R2_3']]
+
+records=''.join('@read'+str(i)+'\nACGTACGTAC\n+\nIIIIIIIIII\n' for i in range(5))
+
+def test_parseFastq():
+    reads=list(cutPrimers.parseFastq(records))
+    assert len(reads)==5
+    assert reads[0]==('read0','ACGTACGTAC','IIIIIIIIII')
+    # The last line may be without the end of line
+    assert list(cutPrimers.parseFastq(records[:-1]))==reads
+
+def test_parseFastqTruncated():
+    # File ends in the middle of the last record
+    text='\n'.join(records.split('\n')[:18])+'\n'
+    with pytest.raises(ValueError,match='without the whole record'):
+        list(cutPrimers.parseFastq(text))
+
+def test_parseFastqQualityLength():
+    text=records.replace('IIIIIIIIII\n@read3','IIIIIIIII\n@read3')
+    with pytest.raises(ValueError,match='Lengths of sequence and quality'):
+        list(cutPrimers.parseFastq(text))
+
+def test_makeReadsIndex(tmp_path):
+    readsFile=str(tmp_path/'reads.fastq')
+    with open(readsFile,'w') as file:
+        file.write(records)
+    offsets,readsNum=cutPrimers.makeReadsIndex(readsFile,2)
+    assert readsNum==5
+    assert offsets==[0,2*len(records)//5,4*len(records)//5]
+
+def test_makeReadsIndexTruncated(tmp_path):
+    readsFile=str(tmp_path/'reads.fastq')
+    with open(readsFile,'w') as file:
+        file.write('\n'.join(records.split('\n')[:18])+'\n')
+    with pytest.raises(ValueError,match='without the whole record'):
+        cutPrimers.makeReadsIndex(readsFile,2)
+
+def test_bgzfTruncated(tmp_path):
+    readsFile=str(tmp_path/'reads.fastq.gz')
+    writer=bgzf.BgzfWriter(readsFile,'wb')
+    writer.write(records.encode())
+    writer.close()
+    with open(readsFile,'rb') as file:
+        data=file.read()
+    with open(readsFile,'wb') as file:
+        file.write(data[:len(data)-40])
+    handle=cutPrimers.openReadsFile(readsFile)[0]
+    with pytest.raises(ValueError,match='Wrong format of BGZF-file'):
+        handle.read()
+    handle.close()
+
+def randomSeq(rand,length):
+    return(''.join(rand.choice('ACGT') for i in range(length)))
+
+def addErrors(rand,seq,errorsNum):
+    # Add substitutions, insertions and deletions to random positions of the sequence
+    for i in range(errorsNum):
+        if seq=='':
+            break
+        pos=rand.randrange(len(seq))
+        errorType=rand.choice(['substitution','insertion','deletion'])
+        if errorType=='substitution':
+            seq=seq[:pos]+rand.choice([c for c in 'ACGT' if c!=seq[pos]])+seq[pos+1:]
+        elif errorType=='insertion':
+            seq=seq[:pos]+rand.choice('ACGT')+seq[pos:]
+        else:
+            seq=seq[:pos]+seq[pos+1:]
+    return(seq)
+
+def checkSearchMate(matcher,seq,mateSeq,errNumber):
+    # Primer found by the primer of the other read should be the same part of the sequence as found by fuzzy search
+    # Otherwise searchMate should return None
+    m=matcher.searchMate(0,seq,mateSeq)
+    if m is None:
+        return(False)
+    expected=matcher.compilePattern(0,errNumber).search(seq)
+    assert expected is not None and m.span()==expected.span(),(seq,mateSeq)
+    return(True)
+
+def test_searchMate():
+    rand=random.Random(1)
+    errNumber=3
+    foundNums=Counter()
+    for i in range(1500):
+        primer=randomSeq(rand,rand.randint(15,30))
+        matcher=cutPrimers.PrimerMatcher(['('+primer+')'],errNumber,overlap=True)
+        # Primer at the 3'-end of read with the same synthesis errors as in the other read
+        copy=addErrors(rand,primer,rand.randint(0,2))
+        seq=randomSeq(rand,rand.randint(0,10))+copy+randomSeq(rand,rand.randint(0,3))
+        foundNums['synthesis error']+=checkSearchMate(matcher,seq,cutPrimers.revComplement(copy),errNumber)
+        # Primer occurs twice, with the same or other errors
+        copy2=addErrors(rand,primer,rand.randint(0,2))
+        seq=randomSeq(rand,rand.randint(0,5))+copy+randomSeq(rand,rand.randint(0,5))+copy2
+        foundNums['twice']+=checkSearchMate(matcher,seq,cutPrimers.revComplement(copy),errNumber)
+        # Primer of the other read is truncated from one of its ends
+        cut=rand.randint(1,4)
+        mateSeq=cutPrimers.revComplement(copy)
+        mateSeq=rand.choice([mateSeq[cut:],mateSeq[:-cut]])
+        seq=randomSeq(rand,rand.randint(0,10))+copy+randomSeq(rand,rand.randint(0,3))
+        foundNums['truncated']+=checkSearchMate(matcher,seq,mateSeq,errNumber)
+    # Most primers with the same errors in both reads should be found without fuzzy search
+    assert foundNums['synthesis error']>1000
+
+def dpDistances(seq,text):
+    # Semi-global edit distance by plain dynamic programming: primer may begin at any position of the text
+    # It returns the last row (distances of the whole sequence to parts of the text that end at each position)
+    # and the last column (distances of each prefix of the sequence to parts of the text that end at the end of the text)
+    row=[0]*(len(text)+1)
+    lastColumn=[0]
+    for i,c in enumerate(seq,1):
+        newRow=[i]
+        for j,t in enumerate(text,1):
+            newRow.append(min(row[j-1]+(c!=t),row[j]+1,newRow[j-1]+1))
+        row=newRow
+        lastColumn.append(row[-1])
+    return(row,lastColumn)
+
+def test_myersDistance():
+    rand=random.Random(2)
+    for i in range(400):
+        seq=randomSeq(rand,rand.choice([rand.randint(1,30),rand.randint(60,80)]))
+        # Reads are shorter than primer, or contain primer with errors, or are random
+        textType=rand.choice(['short','primer','random'])
+        if textType=='short':
+            text=randomSeq(rand,rand.randint(0,len(seq)-1))
+        elif textType=='primer':
+            text=randomSeq(rand,rand.randint(0,20))+addErrors(rand,seq,rand.randint(0,5))+randomSeq(rand,rand.randint(0,20))
+        else:
+            text=randomSeq(rand,rand.randint(1,100))
+        row,lastColumn=dpDistances(seq,text)
+        peq=cutPrimers.makePeq(seq)
+        assert cutPrimers.myersDistance(peq,len(seq),text)==min(row)
+        # prefixDistances[k] is the distance of seq[:k] to the end of the text (see PrimerMatcher.searchPrefix)
+        dist,prefixDistances=cutPrimers.myersDistance(peq,len(seq),text,prefixes=True)
+        assert dist==min(row)
+        assert prefixDistances==lastColumn
+        dist,ends=cutPrimers.myersDistance(peq,len(seq),text,ends=True)
+        assert dist==min(row)
+        assert ends==[j for j,d in enumerate(row) if d==min(row)]
+
+def diagonalVotes(seqs,errNumber,read):
+    # Votes of primers by parts found on the same diagonal, counted by brute force (see PrimerLocator)
+    # It returns the best primer and list of primers with at most one vote less, as PrimerLocator.findCandidatePrimers
+    votes={}
+    for primerNum,seq in enumerate(seqs):
+        partLen=max(len(seq)//(errNumber+1),1)
+        diagonals=Counter()
+        for partStart in range(len(seq)-partLen+1):
+            for pos in range(len(read)-partLen+1):
+                if read[pos:pos+partLen]==seq[partStart:partStart+partLen]:
+                    diagonals[pos-partStart]+=1
+        if diagonals:
+            votes[primerNum]=max(diagonals.values())
+    if not votes:
+        return(None,[])
+    primerNums=sorted((num for num in votes.keys() if votes[num]>=max(votes.values())-1),key=lambda num:(-votes[num],num))
+    return(primerNums[0],primerNums[1:])
+
+def test_primerLocator(tmp_path):
+    errNumber=3
+    primerB='GATTCCAGTACGGTCATGCA'
+    primerA='TTGACCGTAGCATCGAGTCC'
+    # Primer C differs from A only by the last letter, so it has one vote less than A
+    primerC=primerA[:-1]+'A'
+    seqs=[primerB,primerA,primerC]
+    primersFile=str(tmp_path/'primers.fa')
+    with open(primersFile,'w') as file:
+        for name,seq in zip('BAC',seqs):
+            file.write('>'+name+'\n'+seq+'\n')
+    primers,names,hashes,hashLens,maxPrimerLen=cutPrimers.readPrimersFile(primersFile,errNumber)
+    # Read begins with primer A with two substitutions, so 6 of its parts of 5 letters are present
+    # After it, 6 parts of primer B are found by chance, each of them on its own diagonal
+    read=primerA[:6]+'A'+primerA[7:13]+'A'+primerA[14:]
+    for partStart in [15,12,9,6,3,0]:
+        read+='A'+primerB[partStart:partStart+5]
+    # With hashes, B has as many votes as A and is the best one, because its number is smaller
+    assert cutPrimers.findCandidatePrimers(read,hashes,hashLens)==(0,[1,2])
+    locator=cutPrimers.PrimerLocator(seqs,[errNumber]*3,len(read))
+    assert locator.findCandidatePrimers(read)==(1,[2])
+    assert diagonalVotes(seqs,errNumber,read)==(1,[2])
+    # Random reads with primers that have errors
+    rand=random.Random(3)
+    seqs=[randomSeq(rand,rand.randint(18,26)) for i in range(30)]
+    locator=cutPrimers.PrimerLocator(seqs,[errNumber]*len(seqs),60)
+    foundNum=0
+    for i in range(300):
+        primerNum=rand.randrange(len(seqs))
+        read=(randomSeq(rand,rand.randint(0,5))+addErrors(rand,seqs[primerNum],rand.randint(0,3))+randomSeq(rand,60))[:60]
+        bestPrimer,goodPrimerNums=locator.findCandidatePrimers(read)
+        assert (bestPrimer,goodPrimerNums)==diagonalVotes(seqs,errNumber,read)
+        foundNum+=(bestPrimer==primerNum or primerNum in goodPrimerNums)
+    assert foundNum>290
+
+def writeBgzf(readsFile,bgzfFile):
+    # Small blocks, so batches of reads end in different blocks
+    writer=bgzf.BgzfWriter(bgzfFile,'wb')
+    with gzip.open(readsFile,'rb') as file:
+        data=file.read()
+    for i in range(0,len(data),5000):
+        writer.write(data[i:i+5000])
+        writer.flush()
+    writer.close()
+
+def runCutPrimers(tmp_path,readsFiles,outDir,args):
+    # Run cutPrimers.py with example primers. It returns process and list of its output files
+    os.makedirs(outDir,exist_ok=True)
+    outputFiles=[os.path.join(outDir,fileName) for fileName in ['trimmed_R1.fastq','trimmed_R2.fastq','untrimmed_R1.fastq','untrimmed_R2.fastq','stat.tab']]
+    process=subprocess.Popen([sys.executable,cutPrimersFile,'-r1',readsFiles[0],'-r2',readsFiles[1],
+                              '-pr15',primersFiles[0],'-pr25',primersFiles[1],'-pr13',primersFiles[2],'-pr23',primersFiles[3],
+                              '-tr1',outputFiles[0],'-tr2',outputFiles[1],'-utr1',outputFiles[2],'-utr2',outputFiles[3],
+                              '-stat',outputFiles[4],'-t','1','-bs','100']+args,
+                             stdout=subprocess.PIPE,stderr=subprocess.STDOUT,text=True)
+    return(process,outputFiles)
+
+def readOutput(outputFiles):
+    outputs=[]
+    for outputFile in outputFiles:
+        with open(outputFile,'rb') as file:
+            outputs.append(file.read())
+    return(outputs)
+
+@pytest.mark.parametrize('inputType',['plain','gzip','bgzf'])
+def test_resume(tmp_path,inputType):
+    readsFiles=[str(tmp_path/'reads_R1.fastq.gz'),str(tmp_path/'reads_R2.fastq.gz')]
+    benchmarkCutPrimers.generateReads(primersFiles,readsFiles[0],readsFiles[1],3000,150,0.01,0.3,0.1,0.05,0.05,1)
+    if inputType=='plain':
+        for i,readsFile in enumerate(readsFiles):
+            readsFiles[i]=readsFile[:-3]
+            with gzip.open(readsFile,'rb') as file,open(readsFiles[i],'wb') as outFile:
+                outFile.write(file.read())
+    elif inputType=='bgzf':
+        for i,readsFile in enumerate(readsFiles):
+            readsFiles[i]=str(tmp_path/('reads_R'+str(i+1)+'.bgzf.fastq.gz'))
+            writeBgzf(readsFile,readsFiles[i])
+    process,outputFiles=runCutPrimers(tmp_path,readsFiles,str(tmp_path/'ordered'),['-ord'])
+    process.communicate()
+    expected=readOutput(outputFiles)
+    # Trimming is killed after several batches have been written, and then it is continued from the checkpoint
+    checkpointFile=str(tmp_path/'checkpoint')
+    process,outputFiles=runCutPrimers(tmp_path,readsFiles,str(tmp_path/'resumed'),['-cp',checkpointFile,'-ci','0'])
+    while process.poll() is None:
+        try:
+            with open(checkpointFile,'rb') as file:
+                state=pickle.load(file)['samples'][0]
+        except (OSError,EOFError,pickle.UnpicklingError):
+            time.sleep(0.01)
+            continue
+        if state['batchesDone']>=5:
+            process.kill()
+            break
+    process.communicate()
+    assert process.returncode!=0 and not state['closed']
+    if inputType=='gzip':
+        assert state['inputOffsets']==(None,None)
+    else:
+        assert None not in state['inputOffsets']
+    process,outputFiles=runCutPrimers(tmp_path,readsFiles,str(tmp_path/'resumed'),['-cp',checkpointFile,'-resume'])
+    process.communicate()
+    assert readOutput(outputFiles)==expected
+
+def test_resumeOtherParameters(tmp_path):
+    readsFiles=[str(tmp_path/'reads_R1.fastq.gz'),str(tmp_path/'reads_R2.fastq.gz')]
+    benchmarkCutPrimers.generateReads(primersFiles,readsFiles[0],readsFiles[1],300,150,0.01,0.3,0.1,0.05,0.05,1)
+    checkpointFile=str(tmp_path/'checkpoint')
+    process,outputFiles=runCutPrimers(tmp_path,readsFiles,str(tmp_path/'output'),['-cp',checkpointFile])
+    process.communicate()
+    # Other number of errors changes which reads are trimmed
+    process,outputFiles=runCutPrimers(tmp_path,readsFiles,str(tmp_path/'output'),['-cp',checkpointFile,'-resume','-err','2'])
+    stdout=process.communicate()[0]
+    assert 'made for other samples or parameters' in stdout